@@ -0,0 +1,172 @@
+import json
+import math
+import platform
+import queue
+import time
+import arrow
+import sample_mathlock_rest as rest_sample
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Sequence
+
+
+class MathLockBenchmark:
+    """
+    Benchmark suite for both samples: REST API operations (encryption, decryption and all 4 arithmetic ops over the
+    ciphertext) and homomorphic SQL updates inside Postgres by our custom extension.
+    Every operation is executed 'warmup' times without measuring, then 'iterations' times by 'concurrency' threads,
+    where each call is timed separately. Results are given as latency percentiles p50/p90/p99/max (in milliseconds) and
+    throughput in ops/sec per operation type, and may be written into JSON file to track regressions between releases.
+    """
+    def __init__(self, iterations: int = 100, warmup: int = 10, concurrency: int = 1) -> None:
+        self.iterations = iterations
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.results = {}  # operation name -> its statistics
+
+    # region public methods
+
+    def run_operation(self, name: str, operation: Callable) -> dict:
+        """ The method benchmarks given operation, which is called without arguments. Failed calls are reported and
+        counted as errors (separately for warmup), so they don't abort the benchmark """
+        warmup_errors = 0
+        for _ in range(self.warmup):
+            try:
+                operation()
+            except Exception as exc:
+                print(f"Warmup of operation {name} failed: {exc}")
+                warmup_errors += 1
+
+        def timed_call(_) -> [float, None]:
+            start_time = time.perf_counter()
+            try:
+                operation()
+            except Exception as exc:
+                print(f"Operation {name} failed: {exc}")
+                return None
+            return time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        if self.concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                latencies = list(executor.map(timed_call, range(self.iterations)))
+        else:
+            latencies = [timed_call(i) for i in range(self.iterations)]
+        seconds = time.perf_counter() - start_time
+
+        self.results[name] = self.summarize([latency for latency in latencies if latency is not None], seconds)
+        self.results[name]["errors"] = latencies.count(None)
+        self.results[name]["warmup_errors"] = warmup_errors
+        self.print_stats(name, self.results[name])
+        return self.results[name]
+
+    def run_rest(self, app: rest_sample.SampleMathLockApp, num1: str = "12.6785", num2: str = "3.8") -> dict:
+        """ The method benchmarks encryption, decryption and all 4 arithmetic ops over the ciphertext via REST API.
+        Results without a value or ciphertext cells are counted as errors """
+        encrypted1 = app.do_encryption(num1)
+        encrypted2 = app.do_encryption(num2)
+
+        cells = ("a", "b", "c", "d")
+        self.run_operation("rest.encrypt", lambda: self.__checked(app.do_encryption(num1), cells))
+        self.run_operation("rest.decrypt", lambda: self.__checked(app.do_decryption(encrypted1), ("value",)))
+        self.run_operation("rest.multiplication",
+                           lambda: self.__checked(app.do_multiplication(encrypted1, encrypted2), cells))
+        self.run_operation("rest.division", lambda: self.__checked(app.do_division(encrypted1, encrypted2), cells))
+        self.run_operation("rest.addition", lambda: self.__checked(app.do_addition(encrypted1, encrypted2), cells))
+        self.run_operation("rest.subtraction",
+                           lambda: self.__checked(app.do_subtraction(encrypted1, encrypted2), cells))
+        return self.results
+
+    def run_postgres(self, postgres_sample, table_name: str, row_id: int) -> dict:
+        """ The method benchmarks all 4 homomorphic SQL updates of the given row. Every thread works over its own
+        pooled connection, so the pool of the sample is extended to 'concurrency' connections if it's smaller """
+        postgres_sample.ensure_pool(self.concurrency)
+        actions = {"sql.multiplication": "homomorphic_multiplication", "sql.division": "homomorphic_division",
+                   "sql.addition": "homomorphic_addition", "sql.subtraction": "homomorphic_subtraction"}
+        with ExitStack() as stack:
+            workers = queue.Queue()
+            for _ in range(self.concurrency):
+                workers.put(stack.enter_context(postgres_sample.pooled_worker()))
+
+            for name, action in actions.items():
+                self.run_operation(name, lambda action=action: self.__with_worker(workers, action, table_name, row_id))
+
+        return self.results
+
+    def report(self) -> dict:
+        """ The method gives machine-readable report of all benchmarked operations """
+        return {"timestamp": arrow.utcnow().isoformat(), "python": platform.python_version(),
+                "platform": platform.platform(), "iterations": self.iterations, "warmup": self.warmup,
+                "concurrency": self.concurrency, "results": self.results}
+
+    def write_report(self, path: str) -> dict:
+        """ The method writes JSON report into the given file """
+        report = self.report()
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Benchmark report has been written into: {path}")
+        return report
+
+    @staticmethod
+    def summarize(latencies: Sequence, seconds: float) -> dict:
+        """ The method gives latency percentiles in milliseconds and throughput of the operation """
+        latencies = sorted(latencies)
+        stats = {"count": len(latencies), "seconds": seconds,
+                 "ops_per_sec": len(latencies) / seconds if seconds else 0.0}
+        for name, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+            stats[f"{name}_ms"] = MathLockBenchmark.percentile(latencies, percent) * 1000
+
+        return stats
+
+    @staticmethod
+    def percentile(sorted_values: Sequence, percent: float) -> float:
+        """ The method gives percentile by nearest-rank method, values shall be sorted """
+        if not sorted_values:
+            return 0.0
+
+        rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+        return sorted_values[rank - 1]
+
+    @staticmethod
+    def print_stats(name: str, stats: dict) -> None:
+        """ The method prints statistics of the operation """
+        print(f"{name}: {stats['ops_per_sec']:.1f} ops/sec, p50 {stats['p50_ms']:.3f} ms, "
+              f"p90 {stats['p90_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms, "
+              f"errors {stats.get('errors', 0)}")
+
+    # endregion
+
+    # region private protected methods
+
+    @staticmethod
+    def __checked(result: dict, fields: Sequence) -> dict:
+        """ The method fails on REST API result without expected fields - the client doesn't raise on failed server
+        response, so such a call would be counted as a success otherwise """
+        missing = [field for field in fields if field not in result]
+        if missing:
+            raise RuntimeError(f"Server response is missing {missing}: {result}")
+
+        return result
+
+    @staticmethod
+    def __with_worker(workers: queue.Queue, action: str, table_name: str, row_id: int) -> None:
+        """ The method executes SQL action by any free worker, each worker has its own connection """
+        worker = workers.get()
+        try:
+            getattr(worker, action)(table_name, row_id)
+        finally:
+            workers.put(worker)
+
+    # endregion
+
+
+if __name__ == '__main__':
+
+    # feel free to customize iterations, warmup and concurrency, and to add Postgres benchmark:
+    #   import sample_postgres
+    #   benchmark.run_postgres(sample_postgres.MathLockPostgresSample(), "my_unique_db_name", 1)
+    # where the table shall already contain the row with given ID
+    benchmark = MathLockBenchmark(iterations=100, warmup=10, concurrency=4)
+    with rest_sample.SampleMathLockApp(pool_size=4) as rest_app:
+        benchmark.run_rest(rest_app)
+    benchmark.write_report("mathlock_benchmark.json")
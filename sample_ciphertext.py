@@ -0,0 +1,243 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype, take
+
+
+class Ciphertext:
+    """
+    Compact ciphertext of a single value. All our ciphertexts are 2x2 matrices (for Demo), with cells a, b, c, d, where
+    every cell is a number of 64 bit length at least, so cells are kept as decimal strings - exactly the way they
+    come from REST API and Postgres.
+    It replaces dicts {"a", "b", "c", "d"} in hot paths and converts to/from both formats:
+        - REST API json: {"a": ..., "b": ..., "c": ..., "d": ...}
+        - Postgres literal of 'mathlock' type: {a,b,c,d}
+    """
+    __slots__ = ("a", "b", "c", "d")
+
+    def __init__(self, a: [int, str], b: [int, str], c: [int, str], d: [int, str]) -> None:
+        self.a = str(a)
+        self.b = str(b)
+        self.c = str(c)
+        self.d = str(d)
+
+    def __iter__(self):
+        return iter((self.a, self.b, self.c, self.d))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Ciphertext):
+            return NotImplemented
+
+        return tuple(self) == tuple(other)
+
+    def __hash__(self) -> int:
+        return hash(tuple(self))
+
+    def __str__(self) -> str:
+        return self.to_postgres()
+
+    def __repr__(self) -> str:
+        return f"Ciphertext({self.to_postgres()})"
+
+    # region public methods
+
+    @classmethod
+    def from_dict(cls, m1: dict) -> "Ciphertext":
+        """ builds ciphertext from REST API json """
+        return cls(m1["a"], m1["b"], m1["c"], m1["d"])
+
+    @classmethod
+    def from_postgres(cls, literal: str) -> "Ciphertext":
+        """ builds ciphertext from Postgres literal {a,b,c,d} """
+        cells = str(literal).strip().strip("{}").split(",")
+        if len(cells) != 4:
+            raise ValueError(f"Ciphertext literal must have exactly 4 cells, got: {literal}")
+
+        return cls(*(cell.strip() for cell in cells))
+
+    def to_dict(self) -> dict:
+        """ gives REST API json of the ciphertext """
+        return {"a": self.a, "b": self.b, "c": self.c, "d": self.d}
+
+    def to_postgres(self) -> str:
+        """ gives Postgres literal {a,b,c,d} of the ciphertext """
+        return f"{'{'}{self.a},{self.b},{self.c},{self.d}{'}'}"
+
+    # endregion
+
+
+@register_extension_dtype
+class CiphertextDtype(ExtensionDtype):
+    """ pandas dtype for ciphertext columns, available by name as well: df[column].astype("mathlock") """
+    name = "mathlock"
+    type = Ciphertext
+    kind = "O"
+    na_value = None
+
+    @classmethod
+    def construct_array_type(cls) -> type:
+        return CiphertextArray
+
+
+class CiphertextArray(ExtensionArray):
+    """
+    Columnar storage of ciphertexts: 4 cells of every ciphertext are kept in one contiguous 2D array of fixed-width
+    ascii strings (rows x 4), plus a mask of missing values. So a column of millions ciphertexts costs one buffer
+    instead of millions of Python dicts and strings, and it's used by pandas as a regular column - it can be read,
+    sliced, filtered, concatenated etc.
+    Parsing and formatting of Postgres literals is vectorized over the whole column.
+    """
+    def __init__(self, cells: np.ndarray, mask: [np.ndarray, None] = None) -> None:
+        cells = np.asarray(cells)
+        if cells.ndim != 2 or cells.shape[1] != 4:
+            raise ValueError(f"Ciphertext cells must be of shape (N, 4), got: {cells.shape}")
+
+        self._cells = np.ascontiguousarray(cells, dtype=cells.dtype if cells.dtype.kind == "S" else np.bytes_)
+        self._mask = np.zeros(len(cells), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+    # region public methods
+
+    @classmethod
+    def from_postgres(cls, literals: Iterable) -> "CiphertextArray":
+        """ parses Postgres literals {a,b,c,d} of the whole column at once, None stands for missing value """
+        literals = np.asarray(list(literals), dtype=object)
+        mask = pd.isna(literals).astype(bool)
+        valid = literals[~mask]
+        if len(valid):
+            malformed = np.char.count(valid.astype(np.str_), ",") != 3
+            if malformed.any():
+                raise ValueError(f"Ciphertext literal must have exactly 4 cells, got: {valid[malformed][0]}")
+        flat = ",".join(valid).replace("{", "").replace("}", "").replace(" ", "").split(",") if len(valid) else []
+        return cls.__from_flat(flat, mask)
+
+    @classmethod
+    def from_records(cls, records: Iterable) -> "CiphertextArray":
+        """ builds column from REST API jsons {"a", "b", "c", "d"}, None stands for missing value """
+        records = list(records)
+        mask = np.fromiter((record is None for record in records), dtype=bool, count=len(records))
+        flat = [str(record[cell]) for record in records if record is not None for cell in "abcd"]
+        return cls.__from_flat(flat, mask)
+
+    def to_postgres(self) -> np.ndarray:
+        """ formats the whole column into Postgres literals {a,b,c,d}, missing values are None """
+        text = self._cells.astype(np.str_)
+        formatted = np.char.add("{", text[:, 0])
+        for column in range(1, 4):
+            formatted = np.char.add(np.char.add(formatted, ","), text[:, column])
+
+        formatted = np.char.add(formatted, "}").astype(object)
+        formatted[self._mask] = None
+        return formatted
+
+    def to_records(self) -> list:
+        """ gives REST API jsons of the whole column, missing values are None """
+        columns = [self._cells[:, column].astype(np.str_).tolist() for column in range(4)]
+        return [None if missing else {"a": a, "b": b, "c": c, "d": d}
+                for missing, a, b, c, d in zip(self._mask.tolist(), *columns)]
+
+    # endregion
+
+    # region pandas ExtensionArray interface
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy: bool = False) -> "CiphertextArray":
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+
+        mask, flat = [], []
+        for scalar in scalars:
+            if isinstance(scalar, str):
+                scalar = Ciphertext.from_postgres(scalar)
+            elif isinstance(scalar, dict):
+                scalar = Ciphertext.from_dict(scalar)
+            elif not isinstance(scalar, Ciphertext) and pd.isna(scalar):
+                mask.append(True)
+                continue
+            mask.append(False)
+            flat.extend(scalar)
+
+        return cls.__from_flat(flat, np.array(mask, dtype=bool))
+
+    @classmethod
+    def _from_factorized(cls, values: np.ndarray, original: "CiphertextArray") -> "CiphertextArray":
+        return cls.from_postgres(values)
+
+    def _values_for_factorize(self) -> tuple:
+        return self.to_postgres(), None
+
+    def __getitem__(self, item):
+        if pd.api.types.is_integer(item):
+            return None if self._mask[item] else Ciphertext(*self._cells[item].astype(np.str_).tolist())
+
+        if not isinstance(item, slice):
+            item = pd.api.indexers.check_array_indexer(self, item)
+
+        return type(self)(self._cells[item], self._mask[item])
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def __eq__(self, other) -> np.ndarray:
+        if isinstance(other, CiphertextArray):
+            return (self._cells == other._cells).all(axis=1) & ~self._mask & ~other._mask
+        if isinstance(other, Ciphertext):
+            return (self._cells == np.array(list(other), dtype=np.bytes_)).all(axis=1) & ~self._mask
+
+        return np.zeros(len(self), dtype=bool)
+
+    @property
+    def dtype(self) -> CiphertextDtype:
+        return CiphertextDtype()
+
+    @property
+    def nbytes(self) -> int:
+        return self._cells.nbytes + self._mask.nbytes
+
+    def isna(self) -> np.ndarray:
+        return self._mask.copy()
+
+    def take(self, indices, allow_fill: bool = False, fill_value=None) -> "CiphertextArray":
+        rows = take(np.arange(len(self)), indices, allow_fill=allow_fill, fill_value=-1)
+        missing = rows < 0
+        if not missing.any():
+            return type(self)(self._cells[rows], self._mask[rows])
+
+        fill = type(self)._from_sequence([fill_value])
+        width = max(self._cells.dtype.itemsize, fill._cells.dtype.itemsize)
+        cells = np.zeros((len(rows), 4), dtype=f"S{width}")
+        mask = np.empty(len(rows), dtype=bool)
+        cells[~missing] = self._cells[rows[~missing]]
+        mask[~missing] = self._mask[rows[~missing]]
+        cells[missing] = fill._cells[0]
+        mask[missing] = fill._mask[0]
+        return type(self)(cells, mask)
+
+    def copy(self) -> "CiphertextArray":
+        return type(self)(self._cells.copy(), self._mask.copy())
+
+    @classmethod
+    def _concat_same_type(cls, to_concat) -> "CiphertextArray":
+        to_concat = list(to_concat)
+        return cls(np.concatenate([array._cells for array in to_concat]),
+                   np.concatenate([array._mask for array in to_concat]))
+
+    def _formatter(self, boxed: bool = False):
+        return str
+
+    # endregion
+
+    # region private protected methods
+
+    @classmethod
+    def __from_flat(cls, flat: list, mask: np.ndarray) -> "CiphertextArray":
+        """ builds column from flat list of cells of all present values """
+        present = int(len(mask) - mask.sum())
+        if len(flat) != present * 4:
+            raise ValueError("Every ciphertext must have exactly 4 cells")
+
+        parsed = np.array(flat, dtype=np.bytes_).reshape(-1, 4) if flat else np.empty((0, 4), dtype="S1")
+        cells = np.zeros((len(mask), 4), dtype=parsed.dtype)
+        cells[~mask] = parsed
+        return cls(cells, mask)
+
+    # endregion
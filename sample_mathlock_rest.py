@@ -1,6 +1,22 @@
+import asyncio
+import hashlib
+import http.client
 import requests
 import json
+import socket
+import struct
+import threading
 import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Sequence
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from sample_metrics import Metrics, get_output
+from urllib3.util.retry import Retry
 
 
 class SampleMathLockApp:
@@ -35,143 +51,1120 @@ class SampleMathLockApp:
     and around 10 ops / sec using our web-site. Due to many restrictions, such as data conversion overhead, network,
     Flask etc things.
     Precision - in REST version it's limited to 6 digits, only for decrypt operations - just to simplify an answer
+
+    Requests are sent by a pluggable transport:
+        - HttpTransport (default) - HTTP(S) to 'base_url':'port' over one pooled keep-alive session, so TCP
+          connection and TLS handshake are paid once per pooled connection instead of once per operation. Transient
+          failures (connection errors, 502/503/504 etc.) are retried with exponential backoff - all our operations
+          are pure functions of their input, so a repeated POST is safe.
+          To test against a local server, e.g.: SampleMathLockApp(base_url="http://127.0.0.1", port=5000, host=None)
+        - UnixSocketTransport - HTTP over Unix domain socket, for the server running on the same host
+        - LoopbackTransport - calls local handler directly, for test stand-ins and to measure pure serialization cost
+    With 'binary' the client asks for compact binary encoding of ciphertexts (CiphertextWireFormat), which is decoded
+    directly from the response buffer. Servers not supporting it just answer json, which is decoded as before. It's
+    off by default: decoding it in Python is slower than json decoding in C (see 'run_wire_format_test'), so it only
+    pays off where payload size matters, i.e. with HttpTransport over a slow remote link.
+
+    Batch methods 'encrypt_many', 'decrypt_many' and 'math_many' split their input into chunks of 'batch_size' items.
+    If the server advertises batch routes (POST {api}/batch/encrypt|decrypt|math with {"items": [...]} answering
+    {"results": [...]}) in 'Allow' header of OPTIONS response, every chunk goes out as one request, otherwise the items
+    are sent as pipelined single requests. If a batch route answers 404/405/501 anyway, the chunk is resent as single
+    requests and batch routes aren't used anymore.
+
+    Optional result cache ('cache_size' > 0) keeps results of decryption and all 4 arithmetic ops, keyed by the
+    ciphertexts and the operation type. Encryption results are kept in a separate cache, which is used only when
+    asked for by 'cache_encryption' or per call - the same plaintext always gets the same ciphertext then, which is
+    fine for repeated values in a dataset, but it's an explicit trade-off, so it's off by default. Encryption cache has
+    'cache_size' items (1024 without result cache). Failed responses are never cached.
+
+    Every request is measured by 'metrics' (sample_metrics.Metrics, may be shared with other samples): latency per
+    endpoint, round trips, bytes sent/received and errors. With 'quiet' all messages go to 'mathlock' logger instead of
+    stdout.
     """
-    def __init__(self) -> None:
-        self.base_url = 'https://math-lock.com'
-        self.port = 443
+    def __init__(self, base_url: str = 'https://math-lock.com', port: int = 443,
+                 host: [str, None] = "www.math-lock.com", pool_size: int = 10, connect_timeout: float = 3.05,
+                 read_timeout: float = 30.0, max_retries: int = 3, backoff_factor: float = 0.3,
+                 batch_size: int = 100, cache_size: int = 0, cache_ttl: [float, None] = None,
+                 cache_encryption: bool = False, transport: ["Transport", None] = None, binary: bool = False,
+                 metrics: [Metrics, None] = None, quiet: bool = False) -> None:
+        self.base_url = base_url
+        self.port = port
         self.api_suffix = r"/api"
         self.encrypt = r"/encrypt"
         self.decrypt = r"/decrypt"
         self.math = r"/math"
-        self.headers = {"Content-Type": "application/json", "host": "www.math-lock.com"}
+        self.batch = r"/batch"
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.batch_supported = None  # unknown until the first batch call
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+        # may be asked for per call, so it exists even without result cache - it stays empty until it's used
+        self.encryption_cache = ResultCache(cache_size or 1024, cache_ttl)
+        self.cache_encryption = cache_encryption
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.log = get_output(quiet)
+
+        # paths are built only once, instead of on every request
+        self.encrypt_path = f'{self.api_suffix}{self.encrypt}'
+        self.decrypt_path = f'{self.api_suffix}{self.decrypt}'
+        self.math_path = f'{self.api_suffix}{self.math}'
+        self.batch_encrypt_path = f'{self.api_suffix}{self.batch}{self.encrypt}'
+        self.batch_decrypt_path = f'{self.api_suffix}{self.batch}{self.decrypt}'
+        self.batch_math_path = f'{self.api_suffix}{self.batch}{self.math}'
+
+        if transport is None:
+            transport = HttpTransport(base_url, port, host, pool_size, connect_timeout, read_timeout, max_retries,
+                                      backoff_factor)
+        self.transport = transport
+        self.transport.set_accept(CiphertextWireFormat.ACCEPT if binary else "application/json")
+        self.__executor = ThreadPoolExecutor(max_workers=pool_size)  # threads are started on the first batch call
+
+    def __enter__(self) -> "SampleMathLockApp":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     # region public methods
 
     def run_test(self, num1: str, num2: str) -> None:
         """ The method launches all available operations to test functionality """
-        print(f"Num 1 to operate with is: {num1}, Num2: {num2}")
-        print("Let's check ourselves! :)")
-        print(f"Num1 multiplication Num2 in a standard way: {float(num1) * float(num2)}")
-        print(f"Num1 addition Num2 in a standard way: {float(num1) + float(num2)}")
-        print(f"Num1 division Num2 in a standard way: {float(num1) / float(num2)}")
-        print(f"Num1 subtraction Num2 in a standard way: {float(num1) - float(num2)}")
-
-        print("\nNow, let's encrypt our data and perform math. homomorphic operations over the ciphertext'\n")
-        encrypted1 = self.do_encryption(num1)
-        encrypted2 = self.do_encryption(num2)
+        self.log(f"Num 1 to operate with is: {num1}, Num2: {num2}")
+        self.log("Let's check ourselves! :)")
+        self.log(f"Num1 multiplication Num2 in a standard way: {float(num1) * float(num2)}")
+        self.log(f"Num1 addition Num2 in a standard way: {float(num1) + float(num2)}")
+        self.log(f"Num1 division Num2 in a standard way: {float(num1) / float(num2)}")
+        self.log(f"Num1 subtraction Num2 in a standard way: {float(num1) - float(num2)}")
+
+        self.log("\nNow, let's encrypt our data and perform math. homomorphic operations over the ciphertext'\n")
+        encrypted1 = EncryptedValue.from_plaintext(self, num1)
+        encrypted2 = EncryptedValue.from_plaintext(self, num2)
+
+        # all 4 operations don't depend on each other, so they are sent to the server together
+        results = {"multiplication": encrypted1 * encrypted2, "addition": encrypted1 + encrypted2,
+                   "division": encrypted1 / encrypted2, "subtraction": encrypted1 - encrypted2}
+        EncryptedValue.evaluate_all(results.values())
 
-        res_mult = self.do_multiplication(encrypted1, encrypted2)
-        print(f"Ciphertext for multiplication of Num1 and Num2: {res_mult}")
-        dec_mult = self.do_decryption(res_mult)
-        print(f"Decryption of multiplication of Num1 and Num2: {dec_mult['value']}")
-
-        res_add = self.do_addition(encrypted1, encrypted2)
-        print(f"Ciphertext for addition of Num1 and Num2: {res_add}")
-        dec_add = self.do_decryption(res_add)
-        print(f"Decryption of addition of Num1 and Num2: {dec_add['value']}")
-
-        res_div = self.do_division(encrypted1, encrypted2)
-        print(f"Ciphertext for division of Num1 and Num2: {res_div}")
-        dec_div = self.do_decryption(res_div)
-        print(f"Decryption of division of Num1 and Num2: {dec_div['value']}")
-
-        res_subtr = self.do_subtraction(encrypted1, encrypted2)
-        print(f"Ciphertext for subtraction of Num1 and Num2: {res_subtr}")
-        dec_subtr = self.do_decryption(res_subtr)
-        print(f"Decryption of subtraction of Num1 and Num2: {dec_subtr['value']}")
-
-    def run_rest_perf_test(self, num1: str, num2: str, counter: int = 10) -> None:
-        """ The method launches simple perf test """
-        print("\nRunning simple perf test to check REST API performance. Executing 10 POST requests for multiplication,"
-              "\nDon't forget - REST Api performance has nothing to do with the real performance of our scheme, "
-              "it's just a demo with all the restrictions to Net bandwidth etc delays. \nIt's very easy to check - "
-              "just use arbitrary huge numbers to operate with and you will see no difference for the speed")
+        for ops, result in results.items():
+            self.log(f"Ciphertext for {ops} of Num1 and Num2: {result.value}")
+            self.log(f"Decryption of {ops} of Num1 and Num2: {result.decrypt()['value']}")
+
+    def run_rest_perf_test(self, num1: str, num2: str, counter: int = 10, compare_unpooled: bool = False) -> None:
+        """ The method launches simple perf test. With 'compare_unpooled' the same loop is executed first with a new
+        connection per request (the way it was done before the pooled session), to show per-op latency gain. It's off
+        by default, because it doubles the amount of requests sent to the server """
+        self.log(f"\nRunning simple perf test to check REST API performance. Executing {counter} POST requests for "
+                 "multiplication,\nDon't forget - REST Api performance has nothing to do with the real performance of "
+                 "our scheme, it's just a demo with all the restrictions to Net bandwidth etc delays. \nIt's very easy "
+                 "to check - just use arbitrary huge numbers to operate with and you will see no difference for the "
+                 "speed")
 
         encrypted1 = self.do_encryption(num1)
         encrypted2 = self.do_encryption(num2)
+        data = self.prepare_math(encrypted1, encrypted2, "multiplication")
+
+        unpooled_time = None
+        if compare_unpooled and isinstance(self.transport, HttpTransport):
+            start_time = time.perf_counter()
+            for _ in range(0, counter):
+                self.transport.post_unpooled(self.math_path, data)
+            unpooled_time = time.perf_counter() - start_time
+            self.log(f"Time took for {counter} iterations of multiplication, new connection per request: "
+                     f"{'{:.5f}'.format(unpooled_time)} seconds, per op: {unpooled_time / counter * 1000:.3f} ms")
 
         start_time = time.perf_counter()
         my_range = range(0, counter)
         for _ in my_range:
             self.do_multiplication(encrypted1, encrypted2)
 
-        time_finish = '{:.5f}'.format(time.perf_counter() - start_time)
-        print(f"Time took for {counter} iterations of multiplication is: {time_finish} seconds")
+        pooled_time = time.perf_counter() - start_time
+        time_finish = '{:.5f}'.format(pooled_time)
+        self.log(f"Time took for {counter} iterations of multiplication is: {time_finish} seconds, "
+                 f"per op: {pooled_time / counter * 1000:.3f} ms")
+        if unpooled_time:
+            self.log(f"Pooled keep-alive session gain per op: {(unpooled_time - pooled_time) / counter * 1000:.3f} ms "
+                     f"({unpooled_time / pooled_time:.2f}x)")
 
     def prepare_math(self, m1: dict, m2: dict, ops: str) -> json:
         """ builds basic json for arithmetic operations """
         return {"num1": m1, "num2": m2, "ops_type": ops}
 
-    def do_encryption(self, value: str) -> json:
-        """ executes post request to do encryption operation via REST API """
-        res = self.__post_encryption({"value": value})
-        result = json.loads(res.content.decode())
-        del result["error"]
-
-        return result
+    def do_encryption(self, value: str, use_cache: [bool, None] = None) -> json:
+        """ executes post request to do encryption operation via REST API. 'use_cache' overrides 'cache_encryption'
+        for this call """
+        cache = self.__encryption_cache_for(use_cache)
+        key = ResultCache.make_key("encryption", value) if cache is not None else None
+        return self.__cached(cache, key, lambda: self.__post_encryption({"value": value}))
 
     def do_decryption(self, m1: dict) -> json:
         """ executes post request to do decryption operation via REST API """
-        res = self.__post_decryption(m1)
-        result = json.loads(res.content.decode())
-        del result["error"]
-
-        return result
+        key = ResultCache.make_key("decryption", m1) if self.cache is not None else None
+        return self.__cached(self.cache, key, lambda: self.__post_decryption(m1))
 
     def do_subtraction(self, m1: dict,  m2: dict) -> json:
         """ executes post request to do subtraction operation over the ciphertext via REST API """
-        res = self.__post_math_ops(self.prepare_math(m1, m2, "subtraction"))
-        result = json.loads(res.content.decode())
-        del result["error"]
-
-        return result
+        return self.__do_math(m1, m2, "subtraction")
 
     def do_addition(self, m1: dict, m2: dict) -> json:
         """ executes post request to do addition operation over the ciphertext via REST API """
-        res = self.__post_math_ops(self.prepare_math(m1, m2, "addition"))
-        result = json.loads(res.content.decode())
-        del result["error"]
-
-        return result
+        return self.__do_math(m1, m2, "addition")
 
     def do_division(self, m1: dict, m2: dict) -> json:
         """ executes post request to do division operation over the ciphertext via REST API """
-        res = self.__post_math_ops(self.prepare_math(m1, m2, "division"))
-        result = json.loads(res.content.decode())
-        del result["error"]
-
-        return result
+        return self.__do_math(m1, m2, "division")
 
     def do_multiplication(self, m1: dict, m2: dict) -> json:
         """ executes post request to do multiplication operation over the ciphertext via REST API """
-        res = self.__post_math_ops(self.prepare_math(m1, m2, "multiplication"))
-        result = json.loads(res.content.decode())
+        return self.__do_math(m1, m2, "multiplication")
+
+    def encrypt_many(self, values: Iterable, chunk_size: [int, None] = None, use_cache: [bool, None] = None) -> list:
+        """ encrypts all given values in chunks. Results are in the input order, and a failed item is reported as
+        {"error": <reason>} instead of failing the whole batch """
+        values = list(values)
+        cache = self.__encryption_cache_for(use_cache)
+        keys = [ResultCache.make_key("encryption", value) for value in values] if cache is not None else None
+        payloads = [{"value": value} for value in values]
+        return self.__run_batch(self.batch_encrypt_path, self.encrypt_path, payloads, chunk_size, cache, keys)
+
+    def decrypt_many(self, ciphertexts: Iterable, chunk_size: [int, None] = None) -> list:
+        """ decrypts all given ciphertexts in chunks. Results are in the input order, and a failed item is reported as
+        {"error": <reason>} instead of failing the whole batch """
+        payloads = list(ciphertexts)
+        keys = [ResultCache.make_key("decryption", m1) for m1 in payloads] if self.cache is not None else None
+        return self.__run_batch(self.batch_decrypt_path, self.decrypt_path, payloads, chunk_size, self.cache, keys)
+
+    def math_many(self, items: Iterable, ops: [str, None] = None, chunk_size: [int, None] = None) -> list:
+        """ performs arithmetic ops over the ciphertexts in chunks. Every item is either a pair (m1, m2) operated with
+        'ops', or a triple (m1, m2, ops). Results are in the input order, and a failed item is reported as
+        {"error": <reason>} instead of failing the whole batch """
+        payloads = [self.prepare_math(item[0], item[1], item[2] if len(item) > 2 else ops) for item in items]
+        keys = None
+        if self.cache is not None:
+            keys = [ResultCache.make_key(data["ops_type"], data["num1"], data["num2"]) for data in payloads]
+        return self.__run_batch(self.batch_math_path, self.math_path, payloads, chunk_size, self.cache, keys)
+
+    def cache_stats(self) -> dict:
+        """ gives hit/miss/eviction counters of result and encryption caches """
+        stats = {"encryption": self.encryption_cache.stats()}
+        if self.cache is not None:
+            stats["results"] = self.cache.stats()
+
+        return stats
+
+    def supports_batch(self) -> bool:
+        """ checks whether the server advertises batch routes, answer is remembered once the server gave it """
+        if self.batch_supported is None:
+            try:
+                with self.metrics.span("rest", f"OPTIONS {self.batch_math_path}"):
+                    res = self.transport.options(self.batch_math_path)
+                self.metrics.increment("mathlock_round_trips_total", kind="rest")
+            except requests.RequestException:
+                return False
+
+            if res.status_code in (404, 405, 501):
+                self.batch_supported = False
+            elif res.ok:
+                # proxies and CORS layers may answer any OPTIONS with 200, so only explicit 'Allow' counts
+                self.batch_supported = "POST" in res.headers.get("Allow", "")
+            else:
+                return False  # transient failure, ask again next time
+
+        return self.batch_supported
+
+    def close(self) -> None:
+        """ closes all connections of the transport """
+        self.__executor.shutdown(wait=True)
+        self.transport.close()
+
+    # endregion
+
+    # region private protected methods
+
+    def __parse_response(self, res: "TransportResponse") -> json:
+        """ decodes response of a single operation, either binary ciphertext or json """
+        if CiphertextWireFormat.is_binary(res):
+            result = CiphertextWireFormat.decode(res.content)
+        else:
+            result = json.loads(res.content.decode())
         del result["error"]
 
         return result
 
+    def __item_result(self, result: dict) -> dict:
+        """ converts decoded result of one item into the batch format, keeping error only for failed items """
+        error = result.pop("error", None)
+        return {"error": error} if error else result
+
+    def __do_math(self, m1: dict, m2: dict, ops: str) -> json:
+        """ executes one of 4 arithmetic ops, using result cache if it's enabled """
+        key = ResultCache.make_key(ops, m1, m2) if self.cache is not None else None
+        return self.__cached(self.cache, key, lambda: self.__post_math_ops(self.prepare_math(m1, m2, ops)))
+
+    def __encryption_cache_for(self, use_cache: [bool, None]) -> [object, None]:
+        """ gives encryption cache if it should be used for the call """
+        if use_cache is None:
+            use_cache = self.cache_encryption
+
+        return self.encryption_cache if use_cache else None
+
+    def __cached(self, cache: [object, None], key: [bytes, None], post) -> json:
+        """ gives cached result, or executes the post request and caches its result. Failed responses (error status
+        or server error) aren't cached, so the next call asks the server again """
+        if cache is None:
+            return self.__parse_response(post())
+
+        result = cache.get(key)
+        if result is None:
+            res = post()
+            result = self.__parse_single_item(res)
+            error = result.pop("error", None)
+            if res.ok and not error:
+                cache.put(key, result)
+
+        return dict(result)  # the cached copy must not be changed by the caller
+
+    def __run_batch(self, batch_path: str, single_path: str, payloads: list, chunk_size: [int, None],
+                    cache: [object, None] = None, keys: [list, None] = None) -> list:
+        """ sends payloads, which aren't cached yet, in chunks. Equal payloads within the batch are sent only once """
+        if cache is None:
+            return self.__send_batch(batch_path, single_path, payloads, chunk_size)
+
+        results = [cache.get(key) for key in keys]
+        pending = OrderedDict()  # key -> indexes of all not cached items with this key
+        for index, (key, result) in enumerate(zip(keys, results)):
+            if result is None:
+                pending.setdefault(key, []).append(index)
+
+        sent = self.__send_batch(batch_path, single_path, [payloads[indexes[0]] for indexes in pending.values()],
+                                 chunk_size)
+        for (key, indexes), result in zip(pending.items(), sent):
+            if "error" not in result:
+                cache.put(key, result)
+            for index in indexes:
+                results[index] = result
+
+        return [dict(result) for result in results]
+
+    def __send_batch(self, batch_path: str, single_path: str, payloads: list, chunk_size: [int, None]) -> list:
+        """ sends payloads in chunks either via batch route, or as pipelined single requests """
+        if not payloads:
+            return []
+
+        chunk_size = chunk_size or self.batch_size
+        chunks = [payloads[i:i + chunk_size] for i in range(0, len(payloads), chunk_size)]
+        if self.supports_batch():
+            chunk_results = self.__executor.map(partial(self.__post_batch_chunk, batch_path, single_path), chunks)
+        else:
+            chunk_results = (self.__executor.map(partial(self.__post_single_item, single_path), chunk)
+                             for chunk in chunks)
+
+        results = []
+        for chunk_result in chunk_results:
+            results.extend(chunk_result)
+
+        return results
+
+    def __post_batch_chunk(self, path: str, single_path: str, chunk: list) -> list:
+        """ executes post request for the whole chunk via batch route. If the route turns out to be missing, the chunk
+        is sent as single requests, and batch routes aren't used anymore """
+        try:
+            res = self.__post(path, {"items": chunk})
+            if res.status_code in (404, 405, 501):
+                self.batch_supported = False
+                return [self.__post_single_item(single_path, payload) for payload in chunk]
+            res.raise_for_status()
+            if CiphertextWireFormat.is_binary(res):
+                items = CiphertextWireFormat.decode_batch(res.content)
+            else:
+                items = json.loads(res.content.decode())["results"]
+            if len(items) != len(chunk):
+                raise ValueError(f"expected {len(chunk)} results, got {len(items)}")
+        except (requests.RequestException, ValueError, KeyError) as exc:
+            return [{"error": f"Batch request failed: {exc}"} for _ in chunk]
+
+        return [self.__item_result(item) for item in items]
+
+    def __post_single_item(self, path: str, payload: dict) -> dict:
+        """ executes post request for one item of a batch """
+        try:
+            res = self.__post(path, payload)
+            res.raise_for_status()
+            return self.__item_result(self.__parse_single_item(res))
+        except (requests.RequestException, ValueError) as exc:
+            return {"error": f"Request failed: {exc}"}
+
+    def __parse_single_item(self, res: "TransportResponse") -> dict:
+        """ decodes response of one batch item, keeping its error field """
+        if CiphertextWireFormat.is_binary(res):
+            return CiphertextWireFormat.decode(res.content)
+
+        return json.loads(res.content.decode())
+
+    def __post(self, path: str, data: json) -> "TransportResponse":
+        """ executes post request by the transport, measuring it """
+        with self.metrics.span("rest", path):
+            res = self.transport.post(path, data)
+            if not res.ok:
+                self.metrics.increment("mathlock_errors_total", kind="rest", operation=path)
+
+        self.metrics.increment("mathlock_round_trips_total", kind="rest")
+        self.metrics.increment("mathlock_bytes_sent_total", res.sent_bytes, kind="rest")
+        self.metrics.increment("mathlock_bytes_received_total", len(res.content), kind="rest")
+        return res
+
+    def __post_encryption(self, data: json) -> "TransportResponse":
+        """ executes post request itself to encrypt data """
+        return self.__post(self.encrypt_path, data)
+
+    def __post_decryption(self, data: json) -> "TransportResponse":
+        """ executes post request itself to decrypt data """
+        return self.__post(self.decrypt_path, data)
+
+    def __post_math_ops(self, data: json) -> "TransportResponse":
+        """ executes post request itself for all 4 arithmetic ops """
+        return self.__post(self.math_path, data)
+
+    # endregion
+
+
+class TransportError(requests.RequestException):
+    """ Failure of the transport itself, or error status of the response """
+
+
+class TransportResponse:
+    """ Response of any transport: status code, headers and raw body, plus size of the request body """
+    __slots__ = ("status_code", "headers", "content", "sent_bytes")
+
+    def __init__(self, status_code: int, headers: dict, content: bytes, sent_bytes: int = 0) -> None:
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.sent_bytes = sent_bytes
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def raise_for_status(self) -> None:
+        """ raises TransportError for error status of the response """
+        if not self.ok:
+            raise TransportError(f"Server responded with status {self.status_code}")
+
+
+class Transport(ABC):
+    """
+    Interface of transports used by SampleMathLockApp to reach the server. Paths are the same for all transports,
+    e.g. '/api/encrypt', and request body is json
+    """
+    @abstractmethod
+    def post(self, path: str, data: json) -> TransportResponse:
+        """ executes post request with json body """
+
+    @abstractmethod
+    def options(self, path: str) -> TransportResponse:
+        """ executes options request, used to discover available routes """
+
+    def set_accept(self, accept: str) -> None:
+        """ defines media types accepted in responses """
+
+    def close(self) -> None:
+        """ releases all connections of the transport """
+
+
+class HttpTransport(Transport):
+    """ HTTP(S) transport over one pooled keep-alive session with timeouts and bounded retries with backoff """
+    def __init__(self, base_url: str = 'https://math-lock.com', port: int = 443,
+                 host: [str, None] = "www.math-lock.com", pool_size: int = 10, connect_timeout: float = 3.05,
+                 read_timeout: float = 30.0, max_retries: int = 3, backoff_factor: float = 0.3) -> None:
+        self.root_url = f'{base_url}:{port}'
+        self.headers = {"Content-Type": "application/json"}
+        if host:
+            self.headers["host"] = host
+        self.timeout = (connect_timeout, read_timeout)  # (connect, read) in seconds, as accepted by requests
+        self.session = self.__build_session(pool_size, max_retries, backoff_factor)
+        self.__urls = {}  # path -> full URL, built once per path
+
+    def post(self, path: str, data: json) -> TransportResponse:
+        res = self.session.post(self.__url(path), json=data, timeout=self.timeout)
+        return TransportResponse(res.status_code, res.headers, res.content, len(res.request.body or b""))
+
+    def options(self, path: str) -> TransportResponse:
+        res = self.session.options(self.__url(path), timeout=self.timeout)
+        return TransportResponse(res.status_code, res.headers, res.content)
+
+    def post_unpooled(self, path: str, data: json) -> TransportResponse:
+        """ executes post request with a new connection, used only as a baseline for the perf test """
+        res = requests.post(self.__url(path), json=data, verify=True, headers=self.headers, timeout=self.timeout)
+        return TransportResponse(res.status_code, res.headers, res.content)
+
+    def set_accept(self, accept: str) -> None:
+        self.headers["Accept"] = accept
+        self.session.headers["Accept"] = accept
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __url(self, path: str) -> str:
+        """ gives full URL of the path """
+        url = self.__urls.get(path)
+        if url is None:
+            url = self.__urls[path] = f'{self.root_url}{path}'
+
+        return url
+
+    def __build_session(self, pool_size: int, max_retries: int, backoff_factor: float) -> requests.Session:
+        """ builds keep-alive session with connection pool and bounded retries with backoff """
+        retry_kwargs = dict(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                            backoff_factor=backoff_factor, status_forcelist=(429, 502, 503, 504),
+                            raise_on_status=False)
+        try:
+            retry = Retry(allowed_methods=frozenset(["POST"]), **retry_kwargs)
+        except TypeError:  # urllib3 < 1.26
+            retry = Retry(method_whitelist=frozenset(["POST"]), **retry_kwargs)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(self.headers)
+        session.verify = True
+        return session
+
+
+class UnixSocketTransport(Transport):
+    """
+    HTTP transport over Unix domain socket, for the server running on the same host - no TCP/IP and TLS overhead.
+    Every thread keeps its own keep-alive connection, which is reopened once if the server has closed it. Connections
+    are tracked weakly, so the ones of finished threads are released together with their threads
+    """
+    def __init__(self, socket_path: str, host: str = "localhost", timeout: float = 30.0) -> None:
+        self.socket_path = socket_path
+        self.headers = {"Content-Type": "application/json", "Host": host}
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__connections = weakref.WeakSet()
+        self.__lock = threading.Lock()
+
+    def post(self, path: str, data: json) -> TransportResponse:
+        return self.__request("POST", path, json.dumps(data).encode())
+
+    def options(self, path: str) -> TransportResponse:
+        return self.__request("OPTIONS", path, None)
+
+    def set_accept(self, accept: str) -> None:
+        self.headers["Accept"] = accept
+
+    def close(self) -> None:
+        with self.__lock:
+            for connection in list(self.__connections):
+                connection.close()
+            self.__connections.clear()
+        self.__local = threading.local()
+
+    def __request(self, method: str, path: str, body: [bytes, None]) -> TransportResponse:
+        """ executes request over the connection of the current thread """
+        for attempt in range(2):
+            connection = self.__connection()
+            try:
+                connection.request(method, path, body=body, headers=self.headers)
+                res = connection.getresponse()
+                return TransportResponse(res.status, dict(res.getheaders()), res.read(), len(body or b""))
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as exc:
+                connection.close()  # stale keep-alive connection, it will be reconnected
+                if attempt:
+                    raise TransportError(f"Unix socket request failed: {exc}") from exc
+            except (OSError, http.client.HTTPException) as exc:
+                connection.close()
+                raise TransportError(f"Unix socket request failed: {exc}") from exc
+
+    def __connection(self) -> "UnixHTTPConnection":
+        """ gives keep-alive connection of the current thread """
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            connection = self.__local.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            with self.__lock:
+                self.__connections.add(connection)
+
+        return connection
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP connection over Unix domain socket """
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class LoopbackTransport(Transport):
+    """
+    In-process transport, which calls local handler(path, data) directly instead of the server. Handler returns
+    json result, or a pair (status code, json result), and raised exception gives status 500.
+    Request and response still go through json encoding and decoding, as on the wire, so the transport may be used to
+    measure pure serialization overhead, and as a stand-in of the server for tests.
+    Only 'routes' are served, others give status 404 - so batch routes aren't advertised unless they are listed.
+    Ciphertext results are encoded by CiphertextWireFormat, when the client accepts it - the same way a server does.
+    """
+    def __init__(self, handler, routes: Iterable = ("/api/encrypt", "/api/decrypt", "/api/math")) -> None:
+        self.handler = handler
+        self.routes = frozenset(routes)
+        self.accept = "application/json"
+
+    def post(self, path: str, data: json) -> TransportResponse:
+        body = json.dumps(data)
+        if path not in self.routes:
+            return TransportResponse(404, {}, b"", len(body))
+
+        try:
+            result = self.handler(path, json.loads(body))
+        except Exception as exc:
+            return TransportResponse(500, {"Content-Type": "application/json"},
+                                     json.dumps({"error": str(exc)}).encode(), len(body))
+
+        status, result = result if isinstance(result, tuple) else (200, result)
+        if CiphertextWireFormat.MEDIA_TYPE in self.accept:
+            if CiphertextWireFormat.is_ciphertext(result):
+                return TransportResponse(status, {"Content-Type": CiphertextWireFormat.MEDIA_TYPE},
+                                         CiphertextWireFormat.encode(result), len(body))
+            if isinstance(result, dict) and "results" in result and \
+                    all(CiphertextWireFormat.is_ciphertext(item) for item in result["results"]):
+                return TransportResponse(status, {"Content-Type": CiphertextWireFormat.MEDIA_TYPE},
+                                         CiphertextWireFormat.encode_batch(result["results"]), len(body))
+
+        return TransportResponse(status, {"Content-Type": "application/json"}, json.dumps(result).encode(), len(body))
+
+    def options(self, path: str) -> TransportResponse:
+        if path not in self.routes:
+            return TransportResponse(404, {}, b"")
+
+        return TransportResponse(200, {"Allow": "POST, OPTIONS"}, b"")
+
+    def set_accept(self, accept: str) -> None:
+        self.accept = accept
+
+
+class CiphertextWireFormat:
+    """
+    Compact binary encoding of ciphertext responses (media type 'application/x-mathlock-ciphertext'), instead of
+    json with decimal strings. All numbers are big-endian:
+        single ciphertext: magic b"MLC1", flags (uint8, bit 0 - error), error length (uint16), error (utf-8),
+                           then 4 cells a, b, c, d, each: kind (uint8), length (uint16), payload
+        batch:             magic b"MLB1", amount of items (uint32), then every item as a single ciphertext
+    Cell kind 0 is signed integer in two's complement of 'length' bytes, kind 1 is ascii text for any other cell.
+    Decoding works directly over memoryview of the response buffer, without copying it into str and parsing json.
+    Cells are given as decimal strings, exactly like in json responses.
+    """
+    MEDIA_TYPE = "application/x-mathlock-ciphertext"
+    ACCEPT = f"{MEDIA_TYPE}, application/json;q=0.9"
+    CELLS = ("a", "b", "c", "d")
+    __single = struct.Struct(">4sBH")
+    __batch = struct.Struct(">4sI")
+    __cell = struct.Struct(">BH")
+
+    # region public methods
+
+    @staticmethod
+    def is_binary(res: TransportResponse) -> bool:
+        """ checks whether the response is encoded in binary format """
+        return res.headers.get("Content-Type", "").startswith(CiphertextWireFormat.MEDIA_TYPE)
+
+    @staticmethod
+    def is_ciphertext(result) -> bool:
+        """ checks whether json result is a ciphertext """
+        return isinstance(result, dict) and all(cell in result for cell in CiphertextWireFormat.CELLS)
+
+    @classmethod
+    def encode(cls, result: dict) -> bytes:
+        """ encodes ciphertext with its optional error field """
+        error = str(result.get("error") or "").encode()
+        parts = [cls.__single.pack(b"MLC1", 1 if error else 0, len(error)), error]
+        for cell in cls.CELLS:
+            value = str(result[cell])
+            if value.lstrip("-").isdigit() and str(int(value)) == value:
+                number = int(value)
+                payload = number.to_bytes((number.bit_length() + 8) // 8, "big", signed=True)
+                parts.append(cls.__cell.pack(0, len(payload)))
+            else:
+                payload = value.encode("ascii")
+                parts.append(cls.__cell.pack(1, len(payload)))
+            parts.append(payload)
+
+        return b"".join(parts)
+
+    @classmethod
+    def encode_batch(cls, results: Sequence) -> bytes:
+        """ encodes list of ciphertexts """
+        return cls.__batch.pack(b"MLB1", len(results)) + b"".join(cls.encode(result) for result in results)
+
+    @classmethod
+    def decode(cls, content: bytes) -> dict:
+        """ decodes single ciphertext, with 'error' field like in json. Malformed content raises ValueError """
+        view = memoryview(content)
+        result, offset = cls.__decode_from(view, 0)
+        cls.__check_end(view, offset)
+        return result
+
+    @classmethod
+    def decode_batch(cls, content: bytes) -> list:
+        """ decodes list of ciphertexts. Malformed content raises ValueError """
+        view = memoryview(content)
+        magic, count = cls.__unpack(cls.__batch, view, 0)
+        if magic != b"MLB1":
+            raise ValueError("Not a binary ciphertext batch")
+
+        results, offset = [], cls.__batch.size
+        for _ in range(count):
+            result, offset = cls.__decode_from(view, offset)
+            results.append(result)
+
+        cls.__check_end(view, offset)
+        return results
+
     # endregion
 
     # region private protected methods
 
-    def __post_encryption(self, data: json) -> requests.models.Response:
-        """ builds path and executes post request itself to encrypt data """
-        url = f'{self.base_url}:{self.port}{self.api_suffix}{self.encrypt}'
-        return requests.post(url, json=data, verify=True, headers=self.headers)
+    @classmethod
+    def __decode_from(cls, view: memoryview, offset: int) -> tuple:
+        """ decodes single ciphertext at the offset, giving it with offset of the next one """
+        magic, flags, error_length = cls.__unpack(cls.__single, view, offset)
+        if magic != b"MLC1":
+            raise ValueError("Not a binary ciphertext")
+
+        offset += cls.__single.size
+        error = cls.__take(view, offset, error_length)
+        result = {"error": str(error, "utf-8") if flags & 1 else ""}
+        offset += error_length
+        for cell in cls.CELLS:
+            kind, length = cls.__unpack(cls.__cell, view, offset)
+            offset += cls.__cell.size
+            payload = cls.__take(view, offset, length)
+            result[cell] = str(int.from_bytes(payload, "big", signed=True)) if kind == 0 else str(payload, "ascii")
+            offset += length
+
+        return result, offset
+
+    @staticmethod
+    def __unpack(layout: struct.Struct, view: memoryview, offset: int) -> tuple:
+        """ unpacks fixed-size header at the offset, failing on truncated content """
+        try:
+            return layout.unpack_from(view, offset)
+        except struct.error as exc:
+            raise ValueError(f"Truncated binary ciphertext: {exc}") from exc
+
+    @staticmethod
+    def __take(view: memoryview, offset: int, length: int) -> memoryview:
+        """ gives 'length' bytes at the offset, failing on truncated content """
+        if offset + length > len(view):
+            raise ValueError(f"Truncated binary ciphertext: {length} bytes expected at offset {offset}, "
+                             f"{len(view) - offset} available")
+
+        return view[offset:offset + length]
+
+    @staticmethod
+    def __check_end(view: memoryview, offset: int) -> None:
+        """ fails on trailing bytes after the decoded content """
+        if offset != len(view):
+            raise ValueError(f"Unexpected {len(view) - offset} trailing bytes after binary ciphertext")
+
+    # endregion
+
+
+class ResultCache:
+    """
+    Thread-safe size-bounded cache for results of REST API calls, with LRU eviction and optional TTL (in seconds).
+    Keys are built by 'make_key' as a hash of the operation type and canonical form of ciphertexts (cells a,b,c,d),
+    so large ciphertexts aren't kept twice in memory.
+    """
+    def __init__(self, max_size: int = 1024, ttl: [float, None] = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.__items = OrderedDict()  # key -> (expiry time or None, result)
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    # region public methods
+
+    @staticmethod
+    def make_key(ops: str, *operands) -> bytes:
+        """ builds canonical hash of the operation type and its operands - ciphertexts or plain values """
+        parts = [ops]
+        for operand in operands:
+            if isinstance(operand, dict):
+                parts.extend(str(operand[cell]) for cell in "abcd")
+            else:
+                parts.append(str(operand))
+
+        return hashlib.sha256("|".join(parts).encode()).digest()
+
+    def get(self, key: bytes) -> [dict, None]:
+        """ gives cached result, or None if it's missing or expired """
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is not None and item[0] is not None and item[0] < time.monotonic():
+                del self.__items[key]
+                self.expirations += 1
+                item = None
 
-    def __post_decryption(self, data: json) -> requests.models.Response:
-        """ builds path and executes post request itself to decrypt data """
-        url = f'{self.base_url}:{self.port}{self.api_suffix}{self.decrypt}'
-        return requests.post(url, json=data, verify=True, headers=self.headers)
+            if item is None:
+                self.misses += 1
+                return None
 
-    def __post_math_ops(self, data: json) -> requests.models.Response:
-        """ builds path and executes post request itself for all 4 arithmetic ops """
-        url = f'{self.base_url}:{self.port}{self.api_suffix}{self.math}'
-        return requests.post(url, json=data, verify=True, headers=self.headers)
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: bytes, result: dict) -> None:
+        """ caches the result, evicting least recently used ones above the size limit """
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        with self.__lock:
+            self.__items[key] = (expiry, result)
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """ drops all cached results, counters are kept """
+        with self.__lock:
+            self.__items.clear()
+
+    def stats(self) -> dict:
+        """ gives cache counters """
+        return {"size": len(self.__items), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expirations": self.expirations}
 
     # endregion
 
 
+class EncryptedValue:
+    """
+    Lazy handle of a ciphertext. Arithmetic operators + - * / don't call the server, but build an expression graph,
+    which is evaluated only by 'evaluate()' or 'decrypt()'. Identical sub-expressions are computed only once, and all
+    operations which don't depend on each other are sent together via 'math_many', one round trip per graph level.
+    For instance, below expression costs 3 math operations in 3 round trips instead of 4 operations:
+        a, b, c = (EncryptedValue.from_plaintext(app, value) for value in ("12.6785", "3.8", "2"))
+        ((a * b + a * b) / c).decrypt()
+    Plain values may be used as operands as well, they are encrypted in one batch during the evaluation.
+    """
+    __slots__ = ("app", "ops", "operands", "plaintext", "value")
+
+    def __init__(self, app: SampleMathLockApp, ops: [str, None] = None, operands: tuple = (),
+                 plaintext: [str, None] = None, value: [dict, None] = None) -> None:
+        self.app = app
+        self.ops = ops
+        self.operands = operands
+        self.plaintext = plaintext
+        self.value = value  # ciphertext, known from the start for leaves or after the evaluation
+
+    @classmethod
+    def from_plaintext(cls, app: SampleMathLockApp, value: str) -> "EncryptedValue":
+        """ creates leaf, which is encrypted only during the evaluation """
+        return cls(app, plaintext=str(value))
+
+    @classmethod
+    def from_ciphertext(cls, app: SampleMathLockApp, m1: dict) -> "EncryptedValue":
+        """ creates leaf for already encrypted value """
+        return cls(app, value=m1)
+
+    def __add__(self, other) -> "EncryptedValue":
+        return self.__combine("addition", self, other)
+
+    def __radd__(self, other) -> "EncryptedValue":
+        return self.__combine("addition", other, self)
+
+    def __sub__(self, other) -> "EncryptedValue":
+        return self.__combine("subtraction", self, other)
+
+    def __rsub__(self, other) -> "EncryptedValue":
+        return self.__combine("subtraction", other, self)
+
+    def __mul__(self, other) -> "EncryptedValue":
+        return self.__combine("multiplication", self, other)
+
+    def __rmul__(self, other) -> "EncryptedValue":
+        return self.__combine("multiplication", other, self)
+
+    def __truediv__(self, other) -> "EncryptedValue":
+        return self.__combine("division", self, other)
+
+    def __rtruediv__(self, other) -> "EncryptedValue":
+        return self.__combine("division", other, self)
+
+    # region public methods
+
+    def evaluate(self) -> dict:
+        """ computes the expression on the server (only once) and gives its ciphertext """
+        return self.evaluate_all([self])[0]
+
+    def decrypt(self) -> json:
+        """ computes the expression and decrypts it via REST API """
+        return self.app.do_decryption(self.evaluate())
+
+    @staticmethod
+    def evaluate_all(values: Iterable) -> list:
+        """ computes several expressions together, sharing their common sub-expressions and round trips """
+        values = list(values)
+        if not values:
+            return []
+
+        app = values[0].app
+        node_ids = {}  # id of EncryptedValue -> id of its unique sub-expression
+        unique = {}  # structural key of sub-expression -> its id
+        keys, levels, results, members = [], [], [], []
+
+        # iterative post-order traversal, so deep expressions don't hit the recursion limit
+        stack = [(value, False) for value in values]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in node_ids:
+                continue
+            if node.value is None and node.plaintext is None and not expanded:
+                stack.append((node, True))
+                stack.extend((operand, False) for operand in node.operands)
+                continue
+
+            if node.value is not None:
+                key, level = ("ciphertext",) + tuple(str(node.value[cell]) for cell in "abcd"), 0
+            elif node.plaintext is not None:
+                key, level = ("plaintext", node.plaintext), 0
+            else:
+                left, right = (node_ids[id(operand)] for operand in node.operands)
+                key, level = (node.ops, left, right), max(levels[left], levels[right]) + 1
+
+            if key not in unique:
+                unique[key] = len(keys)
+                keys.append(key)
+                levels.append(level)
+                results.append(node.value)
+            node_ids[id(node)] = unique[key]
+            members.append(node)
+
+        by_level = {}
+        for node_id, key in enumerate(keys):
+            if key[0] != "ciphertext":
+                by_level.setdefault(levels[node_id], []).append(node_id)
+
+        plain_ids = by_level.pop(0, [])
+        if plain_ids:
+            plaintexts = [keys[i][1] for i in plain_ids]
+            EncryptedValue.__store(results, plain_ids, app.encrypt_many(plaintexts), "encryption")
+        for level in sorted(by_level):
+            ids = by_level[level]
+            items = [(results[keys[i][1]], results[keys[i][2]], keys[i][0]) for i in ids]
+            EncryptedValue.__store(results, ids, app.math_many(items), "math")
+
+        for node in members:
+            node.value = results[node_ids[id(node)]]
+            node.operands = ()  # the graph below isn't needed anymore
+
+        return [value.value for value in values]
+
+    # endregion
+
+    # region private protected methods
+
+    @staticmethod
+    def __combine(ops: str, left, right) -> "EncryptedValue":
+        """ builds graph node for the operation, wrapping plain values and ciphertexts into leaves """
+        app = left.app if isinstance(left, EncryptedValue) else right.app
+        operands = tuple(EncryptedValue.__wrap(app, operand) for operand in (left, right))
+        return EncryptedValue(app, ops=ops, operands=operands)
+
+    @staticmethod
+    def __wrap(app: SampleMathLockApp, operand) -> "EncryptedValue":
+        """ converts operand into graph node """
+        if isinstance(operand, EncryptedValue):
+            return operand
+        if isinstance(operand, dict):
+            return EncryptedValue.from_ciphertext(app, operand)
+        return EncryptedValue.from_plaintext(app, operand)
+
+    @staticmethod
+    def __store(results: list, ids: list, batch_results: list, ops_type: str) -> None:
+        """ stores batch results for the given sub-expression ids, failing on the first failed item """
+        for node_id, result in zip(ids, batch_results):
+            if "error" in result:
+                raise RuntimeError(f"Homomorphic {ops_type} operation failed: {result['error']}")
+            results[node_id] = result
+
+    # endregion
+
+
+class AsyncMathLockApp:
+    """
+    Asyncio counterpart of SampleMathLockApp with the same operation surface, where every operation is a coroutine.
+    Helpers 'encrypt_many', 'decrypt_many' and 'math_many' keep up to 'concurrency' requests in flight under a
+    semaphore and return results in the input order. Their per-call 'concurrency' may only lower the limit of the
+    instance - it's clamped to 'concurrency' of the instance, which is the size of its thread pool.
+
+    Requests themselves are executed by a thread pool over one pooled keep-alive SampleMathLockApp, so no additional
+    async HTTP library is required to run the sample.
+    """
+    def __init__(self, concurrency: int = 16, app: [SampleMathLockApp, None] = None, **app_kwargs) -> None:
+        self.concurrency = concurrency
+        self.__owns_app = app is None
+        self.app = SampleMathLockApp(pool_size=concurrency, **app_kwargs) if app is None else app
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.math_ops = {"multiplication": self.do_multiplication, "addition": self.do_addition,
+                         "division": self.do_division, "subtraction": self.do_subtraction}
+
+    async def __aenter__(self) -> "AsyncMathLockApp":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    # region public methods
+
+    async def do_encryption(self, value: str) -> json:
+        """ executes encryption operation via REST API """
+        return await self.__run(self.app.do_encryption, value)
+
+    async def do_decryption(self, m1: dict) -> json:
+        """ executes decryption operation via REST API """
+        return await self.__run(self.app.do_decryption, m1)
+
+    async def do_subtraction(self, m1: dict, m2: dict) -> json:
+        """ executes subtraction operation over the ciphertext via REST API """
+        return await self.__run(self.app.do_subtraction, m1, m2)
+
+    async def do_addition(self, m1: dict, m2: dict) -> json:
+        """ executes addition operation over the ciphertext via REST API """
+        return await self.__run(self.app.do_addition, m1, m2)
+
+    async def do_division(self, m1: dict, m2: dict) -> json:
+        """ executes division operation over the ciphertext via REST API """
+        return await self.__run(self.app.do_division, m1, m2)
+
+    async def do_multiplication(self, m1: dict, m2: dict) -> json:
+        """ executes multiplication operation over the ciphertext via REST API """
+        return await self.__run(self.app.do_multiplication, m1, m2)
+
+    async def encrypt_many(self, values: Iterable, concurrency: [int, None] = None) -> list:
+        """ encrypts all given values, keeping up to 'concurrency' requests in flight (clamped to the instance
+        limit) """
+        return await self.__gather(self.do_encryption, [(value,) for value in values], concurrency)
+
+    async def decrypt_many(self, ciphertexts: Iterable, concurrency: [int, None] = None) -> list:
+        """ decrypts all given ciphertexts, keeping up to 'concurrency' requests in flight (clamped to the instance
+        limit) """
+        return await self.__gather(self.do_decryption, [(m1,) for m1 in ciphertexts], concurrency)
+
+    async def math_many(self, items: Iterable, ops: [str, None] = None, concurrency: [int, None] = None) -> list:
+        """ performs arithmetic ops over the ciphertexts, keeping up to 'concurrency' requests in flight (clamped to
+        the instance limit). Every item is either a pair (m1, m2) operated with 'ops', or a triple (m1, m2, ops) """
+        calls = []
+        for item in items:
+            item_ops = item[2] if len(item) > 2 else ops
+            calls.append((self.math_ops[item_ops], item[0], item[1]))
+
+        return await self.__gather(lambda func, m1, m2: func(m1, m2), calls, concurrency)
+
+    def close(self) -> None:
+        """ stops the thread pool and closes the underlying app, if it was created here """
+        self.executor.shutdown(wait=True)
+        if self.__owns_app:
+            self.app.close()
+
+    # endregion
+
+    # region private protected methods
+
+    async def __run(self, func, *args) -> json:
+        """ executes blocking REST call in the thread pool """
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def __gather(self, coro_func, args_list: Sequence, concurrency: [int, None]) -> list:
+        """ awaits all calls with bounded concurrency, results are in the same order as 'args_list'. More calls than
+        threads of the pool can't be in flight, so 'concurrency' is clamped to the instance limit """
+        semaphore = asyncio.Semaphore(min(concurrency or self.concurrency, self.concurrency))
+
+        async def bounded(args):
+            async with semaphore:
+                return await coro_func(*args)
+
+        return await asyncio.gather(*(bounded(args) for args in args_list))
+
+    # endregion
+
+
+def run_coroutine(coro) -> object:
+    """ runs coroutine in a new event loop, the same way on all supported Python versions (asyncio.run is 3.7+) """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def run_concurrency_perf_test(num1: str, num2: str, counter: int = 100, levels: Sequence = (1, 4, 16, 32)) -> None:
+    """ The method compares throughput of sequential SampleMathLockApp and AsyncMathLockApp for multiplication at
+    several concurrency levels """
+    print(f"\nRunning {counter} multiplications sequentially and with AsyncMathLockApp at concurrency levels: {levels}")
+    with SampleMathLockApp() as sync_app:
+        encrypted1 = sync_app.do_encryption(num1)
+        encrypted2 = sync_app.do_encryption(num2)
+
+        start_time = time.perf_counter()
+        for _ in range(counter):
+            sync_app.do_multiplication(encrypted1, encrypted2)
+        sync_time = time.perf_counter() - start_time
+        print(f"Sync client: {counter / sync_time:.2f} ops/sec")
+
+    pairs = [(encrypted1, encrypted2)] * counter
+    for level in levels:
+        async_app = AsyncMathLockApp(concurrency=level)
+        try:
+            start_time = time.perf_counter()
+            run_coroutine(async_app.math_many(pairs, "multiplication"))
+            async_time = time.perf_counter() - start_time
+        finally:
+            async_app.close()
+        print(f"Async client, concurrency {level}: {counter / async_time:.2f} ops/sec "
+              f"({sync_time / async_time:.2f}x of sync)")
+
+
+def run_serialization_overhead_test(counter: int = 10000) -> None:
+    """ The method measures client overhead per operation without any network and crypto: LoopbackTransport answers
+    instantly with a ciphertext of 64 bit cells, so only json encoding/decoding and the client code itself are left """
+    ciphertext = {"a": str(2 ** 64 - 59), "b": str(2 ** 64 - 83), "c": str(2 ** 64 - 95), "d": str(2 ** 64 - 179)}
+    transport = LoopbackTransport(lambda path, data: dict(ciphertext, error=""))
+    with SampleMathLockApp(transport=transport) as app:
+        start_time = time.perf_counter()
+        for _ in range(counter):
+            app.do_multiplication(ciphertext, ciphertext)
+        seconds = time.perf_counter() - start_time
+
+    print(f"Client and serialization overhead: {seconds / counter * 1000000:.2f} us per op, "
+          f"{counter / seconds:.0f} ops/sec at most")
+
+
+def run_wire_format_test(counter: int = 10000) -> None:
+    """ The method compares payload size and decode time of json and binary encoding of a ciphertext response """
+    ciphertext = {"error": "", "a": str(2 ** 64 - 59), "b": str(-2 ** 70 + 3), "c": str(2 ** 100 + 7), "d": "1"}
+    payloads = {"json": json.dumps(ciphertext).encode(), "binary": CiphertextWireFormat.encode(ciphertext)}
+    decoders = {"json": lambda content: json.loads(content.decode()), "binary": CiphertextWireFormat.decode}
+
+    for name, content in payloads.items():
+        decode = decoders[name]
+        start_time = time.perf_counter()
+        for _ in range(counter):
+            decode(content)
+        seconds = time.perf_counter() - start_time
+        print(f"{name}: payload {len(content)} bytes, decode {seconds / counter * 1000000:.2f} us per ciphertext")
+
+
 if __name__ == '__main__':
 
     # choose any (literally) 2 numbers which you want to operate with.
@@ -183,3 +1176,5 @@ if __name__ == '__main__':
 
     my_rest.run_test(num1_, num2_)
     my_rest.run_rest_perf_test(num1_, num2_)
+    # uncomment to compare throughput of sync and async clients, it sends a few hundred requests to the server
+    # run_concurrency_perf_test(num1_, num2_)
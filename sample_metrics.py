@@ -0,0 +1,175 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Generator, Sequence
+
+logger = logging.getLogger("mathlock")
+
+# upper bounds of latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_output(quiet: bool = False) -> Callable:
+    """ gives print for regular mode, or info of 'mathlock' logger for quiet mode """
+    return logger.info if quiet else print
+
+
+class Histogram:
+    """ Latency histogram with fixed buckets, counts are kept per bucket and given cumulative, like Prometheus does """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """ adds the value into its bucket """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """ gives pairs (upper bound, amount of values not greater than it), the last bound is +Inf """
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+class Metrics:
+    """
+    Instrumentation shared by SampleMathLockApp and MathLockPostgresSample (and by any amount of their instances):
+        - latency histograms: 'mathlock_operation_seconds' per REST API endpoint (kind="rest") and per SQL operation
+          of the sample (kind="sql"), and 'mathlock_sql_statement_seconds' per every SQL statement by its command
+        - counters: round trips, bytes sent/received, commits and errors, per kind
+        - hooks: every finished span is given to all callbacks as hook(kind, operation, seconds, error), where error is
+          None or the exception, so timings may be forwarded to any other monitoring
+        - Prometheus text exposition format by 'to_prometheus', and plain dict by 'snapshot'
+    The instance is thread-safe.
+    """
+    def __init__(self, buckets: Sequence = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # (metric name, labels) -> Histogram
+        self.counters = {}  # (metric name, labels) -> value
+        self.hooks = []
+        self.__lock = threading.Lock()
+
+    # region public methods
+
+    @contextmanager
+    def span(self, kind: str, operation: str) -> Generator:
+        """ measures the block as one operation of the kind, e.g. span("rest", "/api/math"). Exception raised by the
+        block is counted as error and raised further """
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self.record(kind, operation, time.perf_counter() - start_time, exc)
+            raise
+
+        self.record(kind, operation, time.perf_counter() - start_time)
+
+    def record(self, kind: str, operation: str, seconds: float, error: [Exception, None] = None) -> None:
+        """ records operation, which took given seconds, and calls all hooks """
+        self.observe("mathlock_operation_seconds", seconds, kind=kind, operation=operation)
+        if error is not None:
+            self.increment("mathlock_errors_total", kind=kind, operation=operation)
+        for hook in self.hooks:
+            hook(kind, operation, seconds, error)
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """ adds value into histogram of given name and labels """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """ increments counter of given name and labels """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_hook(self, hook: Callable) -> None:
+        """ adds callback hook(kind, operation, seconds, error), called on every finished span """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable) -> None:
+        """ removes callback added before """
+        self.hooks.remove(hook)
+
+    def reset(self) -> None:
+        """ drops all collected values, hooks are kept """
+        with self.__lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        """ gives all collected values: counters as {name: {labels: value}}, histograms as {name: {labels: {"count",
+        "sum", "buckets": [[upper bound, cumulative count], ...]}}}, where labels are given as 'key=value,...' """
+        with self.__lock:
+            counters = list(self.counters.items())
+            histograms = [(key, histogram.count, histogram.sum, histogram.cumulative())
+                          for key, histogram in self.histograms.items()]
+
+        result = {"counters": {}, "histograms": {}}
+        for (name, labels), value in counters:
+            result["counters"].setdefault(name, {})[self.__labels_key(labels)] = value
+        for (name, labels), count, seconds, buckets in histograms:
+            result["histograms"].setdefault(name, {})[self.__labels_key(labels)] = {
+                "count": count, "sum": seconds, "buckets": [[bound, total] for bound, total in buckets]}
+
+        return result
+
+    def to_prometheus(self) -> str:
+        """ gives all collected values in Prometheus text exposition format """
+        with self.__lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, histogram.count, histogram.sum, histogram.cumulative())
+                                for key, histogram in self.histograms.items())
+
+        lines, described = [], set()
+        for (name, labels), count, seconds, buckets in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            for bound, total in buckets:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{self.__format_labels(labels + (('le', le),))} {total}")
+            lines.append(f"{name}_sum{self.__format_labels(labels)} {seconds!r}")
+            lines.append(f"{name}_count{self.__format_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self.__format_labels(labels)} {value!r}")
+
+        return "\n".join(lines) + "\n"
+
+    # endregion
+
+    # region private protected methods
+
+    @staticmethod
+    def __labels_key(labels: tuple) -> str:
+        """ gives labels as 'key=value,...' """
+        return ",".join(f"{key}={value}" for key, value in labels)
+
+    @staticmethod
+    def __format_labels(labels: tuple) -> str:
+        """ gives labels in Prometheus format {key="value",...} """
+        if not labels:
+            return ""
+
+        escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+    # endregion
@@ -0,0 +1,197 @@
+import queue
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+from typing import Callable, Iterable
+
+
+class PipelineStage:
+    """
+    One stage of the pipeline: 'workers' threads take items from the bounded input queue of the stage, call
+    function(item) - or function(resource, item), if 'context' is defined - and pass results into the next stage.
+    'context' is a callable giving a context manager (e.g. MathLockPostgresSample.pooled_worker), entered once by every
+    worker thread for its whole lifetime, so each thread works over its own resource, like a pooled DB connection.
+    Items, whose processing failed, are counted as errors and dropped. If the context can't be entered, all items of
+    that worker fail the same way.
+    """
+    def __init__(self, name: str, function: Callable, workers: int = 1, queue_size: int = 100,
+                 context: [Callable, None] = None) -> None:
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.context = context
+        self.input = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0  # sum of processing time by all workers
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.first_error = None
+        self.__lock = threading.Lock()
+        self.__running = self.workers
+
+    # region public methods
+
+    def record(self, seconds: float, depth: int, error: [Exception, None] = None) -> None:
+        """ records processing of one item, taken from the queue of given depth """
+        with self.__lock:
+            self.busy_seconds += seconds
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_sum += depth
+            self.depth_samples += 1
+            if error is None:
+                self.processed += 1
+            else:
+                self.errors += 1
+                self.first_error = self.first_error or f"{type(error).__name__}: {error}"
+
+    def finish_worker(self) -> bool:
+        """ marks one worker as finished, gives True for the last one """
+        with self.__lock:
+            self.__running -= 1
+            return self.__running == 0
+
+    def report(self, seconds: float) -> dict:
+        """ gives throughput, utilization and queue depth statistics of the stage """
+        return {"workers": self.workers, "processed": self.processed, "errors": self.errors,
+                "items_per_sec": self.processed / seconds if seconds else 0.0,
+                "busy_seconds": self.busy_seconds,
+                "utilization": self.busy_seconds / (seconds * self.workers) if seconds else 0.0,
+                "max_queue_depth": self.max_depth, "queue_size": self.input.maxsize,
+                "avg_queue_depth": self.depth_sum / self.depth_samples if self.depth_samples else 0.0,
+                "first_error": self.first_error}
+
+    # endregion
+
+
+class Pipeline:
+    """
+    Streaming pipeline of stages connected by bounded queues, where every stage has its own amount of worker threads.
+    Items go through all stages in parallel, so network-bound stages (REST API) overlap with DB-bound ones, and wall
+    time for N items approaches time of the slowest stage instead of the sum of all stages. When a stage falls behind,
+    its input queue fills up and blocks the stages before it (backpressure), so memory stays bounded by queue sizes.
+    Order of results isn't preserved - items shall carry their own key (e.g. row ID).
+    Every pipeline is run once, since its stages keep statistics of the run.
+    """
+    __done = object()  # end of stream marker
+
+    def __init__(self, queue_size: int = 100, log: Callable = print) -> None:
+        self.queue_size = queue_size
+        self.log = log  # gives the report, e.g. print or any logger method
+        self.stages = []
+
+    # region public methods
+
+    def add_stage(self, name: str, function: Callable, workers: int = 1, queue_size: [int, None] = None,
+                  context: [Callable, None] = None) -> "Pipeline":
+        """ adds the next stage, see PipelineStage. Returns the pipeline itself, so calls may be chained """
+        self.stages.append(PipelineStage(name, function, workers, queue_size or self.queue_size, context))
+        return self
+
+    def run(self, items: Iterable, on_result: [Callable, None] = None) -> dict:
+        """ streams items through all stages, every result of the last stage is given to on_result(result), which
+        is called by a single thread. If it's not defined, results are collected into report as "results".
+        Returns report with per-stage statistics """
+        if not self.stages:
+            raise ValueError("Pipeline has no stages")
+
+        results = []
+        consume = on_result if on_result is not None else results.append
+        output = queue.Queue(maxsize=self.queue_size)
+        threads = []
+        for index, stage in enumerate(self.stages):
+            target = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            next_queue, next_workers = (target.input, target.workers) if target else (output, 1)
+            threads.extend(threading.Thread(target=self.__work, args=(stage, next_queue, next_workers), daemon=True)
+                           for _ in range(stage.workers))
+
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        feeder = threading.Thread(target=self.__feed, args=(items, self.stages[0]), daemon=True)
+        feeder.start()
+
+        while True:
+            result = output.get()
+            if result is self.__done:
+                break
+            consume(result)
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start_time
+
+        report = {"seconds": seconds, "stages": {stage.name: stage.report(seconds) for stage in self.stages}}
+        report["items"] = self.stages[-1].processed
+        report["items_per_sec"] = report["items"] / seconds if seconds else 0.0
+        report["bottleneck"] = max(self.stages, key=lambda stage: stage.busy_seconds / stage.workers).name
+        if on_result is None:
+            report["results"] = results
+
+        self.print_report(report)
+        return report
+
+    def print_report(self, report: dict) -> None:
+        """ prints per-stage statistics of the run """
+        self.log(f"Pipeline processed {report['items']} items in {report['seconds']:.5f} seconds, "
+                 f"{report['items_per_sec']:.1f} items/sec, bottleneck stage: {report['bottleneck']}")
+        for name, stats in report["stages"].items():
+            self.log(f"  {name}: {stats['workers']} workers, {stats['items_per_sec']:.1f} items/sec, utilization "
+                     f"{stats['utilization']:.0%}, queue depth avg {stats['avg_queue_depth']:.1f} max "
+                     f"{stats['max_queue_depth']}/{stats['queue_size']}, errors {stats['errors']}")
+
+    # endregion
+
+    # region private protected methods
+
+    def __feed(self, items: Iterable, stage: PipelineStage) -> None:
+        """ puts all items into the first stage, blocking while its queue is full, then marks end of stream """
+        try:
+            for item in items:
+                stage.input.put(item)
+        finally:
+            for _ in range(stage.workers):
+                stage.input.put(self.__done)
+
+    def __work(self, stage: PipelineStage, next_queue: queue.Queue, next_workers: int) -> None:
+        """ worker thread of the stage, the last finished worker of the stage marks end of stream for the next one """
+        try:
+            with ExitStack() as stack:
+                try:
+                    function = stage.function if stage.context is None else \
+                        partial(stage.function, stack.enter_context(stage.context()))
+                except Exception as exc:
+                    function = partial(self.__fail, exc)
+                self.__process(stage, function, next_queue)
+        finally:
+            if stage.finish_worker():
+                for _ in range(next_workers):
+                    next_queue.put(self.__done)
+
+    def __process(self, stage: PipelineStage, function: Callable, next_queue: queue.Queue) -> None:
+        """ processes items of the stage until end of stream """
+        while True:
+            depth = stage.input.qsize()
+            item = stage.input.get()
+            if item is self.__done:
+                return
+
+            start_time = time.perf_counter()
+            try:
+                result = function(item)
+            except Exception as exc:
+                stage.record(time.perf_counter() - start_time, depth, exc)
+                continue
+
+            stage.record(time.perf_counter() - start_time, depth)
+            next_queue.put(result)
+
+    @staticmethod
+    def __fail(exc: Exception, item) -> None:
+        """ fails processing of the item, when worker couldn't get its resource """
+        raise exc
+
+    # endregion
@@ -1,9 +1,26 @@
+import copy
+import io
+import itertools
+import math
+import re
 import sys
+import threading
+import time
+import uuid
 import arrow
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 import sample_mathlock_rest as rest_sample
+import sample_pipeline
 import pandas as pd
-from typing import Generator
+from sample_ciphertext import Ciphertext, CiphertextArray
+from sample_metrics import Metrics, get_output
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Generator, Iterable
 
 pd.set_option('display.colheader_justify', 'center')
 pd.set_option('display.max_rows', 1000)
@@ -23,19 +40,63 @@ class MathLockPostgresSample:
 
     IMPORTANT: in case you like it and want better demo, you may request us to create specific DB user etc for better
     privacy and to avoid be affected by other users
+
+    The instance itself works over a single connection and isn't thread-safe. For parallel work there is optional
+    connection pool ('pool_size' > 0, or created on demand by 'run_partitioned'), where every worker thread gets its
+    own connection via 'pooled_worker' (waiting for a free one, if all of them are taken), and 'parallel_*' methods
+    split a table by ID ranges between such workers. The pool is extended to the amount of workers, if it's smaller.
+
+    Per-row CRUD and FHE statements are PREPAREd on the server once per connection, table and operation, and then
+    called by EXECUTE with bound parameters, so Postgres doesn't parse and plan them again on every call, and values
+    can't be injected into SQL. Statements of a table are deallocated when it's created or dropped by the sample.
+    Set 'prepared_statements' to False for plain parameterized statements.
+
+    Table existence, columns and their types are read from the catalog and cached ('schema'), and invalidated when the
+    sample creates, drops or alters the table. 'prefetch_schema' loads the whole schema by one query, e.g. at startup.
+
+    All connections are instrumented by 'metrics' (sample_metrics.Metrics), which is shared with the REST API sample:
+    latency per SQL operation and per statement, round trips, bytes of sent statements, commits and errors. With
+    'quiet' all messages go to 'mathlock' logger instead of stdout, which keeps hot loops free of console output.
     """
     def __init__(self, database="mathlock_db", host="46.4.106.106", user="math_lock", password="Afc13advc5sjyg!ysgd",
-                 port="54141", pandas_cell_len: [int, None] = None) -> None:
-        self.conn = psycopg2.connect(database=database, host=host, user=user, password=password, port=port)
+                 port="54141", pandas_cell_len: [int, None] = None, rest_cache_size: int = 0,
+                 pool_size: int = 0, prepared_statements: bool = True, metrics: [Metrics, None] = None,
+                 quiet: bool = False, prefetch_schema: bool = False) -> None:
+        self.connect_params = dict(database=database, host=host, user=user, password=password, port=port,
+                                   connection_factory=InstrumentedConnection)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.log = get_output(quiet)
+        self.conn = psycopg2.connect(**self.connect_params)
+        self.conn.metrics = self.metrics
         self.cursor = self.conn.cursor()
-        self.rest_sample = rest_sample.SampleMathLockApp()  # takes another sample instance
+        self.pool = None
+        self.pool_slots = None  # free connections of the pool, so workers wait for a connection instead of failing
+        if pool_size:
+            self.ensure_pool(pool_size)
+        # takes another sample instance, 'rest_cache_size' > 0 enables its cache for repeated decryption of ciphertexts
+        self.rest_sample = rest_sample.SampleMathLockApp(cache_size=rest_cache_size, metrics=self.metrics, quiet=quiet)
         self.mult_result = "mult_result"  # column name for FHE multiplication results
         self.div_result = "div_result"  # column name for FHE division results
         self.add_result = "add_result"  # column name for FHE addition results
         self.sub_result = "sub_result"  # column name for FHE subtraction results
         self.number1 = "number1"
         self.number2 = "number2"
+        self.results_dirty = "results_dirty"  # flag of rows, whose results must be recomputed by 'refresh_results'
+        # FHE operation -> (result column, operator of our extension)
+        self.math_operations = {"multiplication": (self.mult_result, "*"), "division": (self.div_result, "/"),
+                                "addition": (self.add_result, "+"), "subtraction": (self.sub_result, "-")}
+        self.mathlock_type_oid = None  # OID of 'mathlock' type, fetched once on the first need
+        self.aggregates_created = False  # encrypted aggregates are created once on the first need
+        # table name -> {column: (type OID, type name)} in column order, or None for missing table, shared with
+        # pooled workers
+        self.schema = {}
+        self.prepared_statements = prepared_statements
+        # (connection, table, operation) -> name of PREPAREd statement, shared with pooled workers
+        self.statements = {}
+        self.__statement_ids = itertools.count(1)
         pd.set_option('display.max_colwidth', pandas_cell_len)  # None gives unlimited length
+        if prefetch_schema:
+            self.prefetch_schema()
 
     # region public methods
 
@@ -57,17 +118,114 @@ class MathLockPostgresSample:
 
     def get_all_column_names(self, table_name) -> list:
         """ The method gives all column names in the given table """
-        self.cursor.execute(f"SELECT * FROM {table_name}")
-        column_names = [desc[0] for desc in self.cursor.description]
+        column_names = list(self.get_column_types(table_name))
         for i in column_names:
-            print(i)
+            self.log(i)
         return column_names
 
     def print_entire_table(self, table_name) -> None:
         """ The method prints whole SQL table by given name """
-        my_table = pd.read_sql(f"SELECT * FROM {table_name}", self.conn)
+        my_table = self.read_table_frame(table_name)
         print(my_table)
 
+    def read_table_frame(self, table_name: str) -> pd.DataFrame:
+        """ The method reads whole SQL table into DataFrame, where all 'mathlock' columns are stored as compact
+        CiphertextArray (dtype 'mathlock') instead of per-row strings """
+        self.cursor.execute(f"SELECT * FROM {table_name}")
+        return self.build_frame(self.cursor.description, self.cursor.fetchall())
+
+    def build_frame(self, description: tuple, rows: list) -> pd.DataFrame:
+        """ The method builds DataFrame from fetched rows, converting 'mathlock' columns into CiphertextArray """
+        mathlock_oid = self.get_mathlock_type_oid()
+        columns = list(zip(*rows)) if rows else [()] * len(description)
+        data = {}
+        for column, values in zip(description, columns):
+            if column[1] == mathlock_oid:
+                data[column[0]] = CiphertextArray.from_postgres(values)
+            else:
+                data[column[0]] = list(values)
+
+        return pd.DataFrame(data, columns=[column[0] for column in description])
+
+    def get_column_types(self, table_name: str) -> dict:
+        """ The method gives {column name: type name} of the table in column order (empty for missing table), from
+        the schema cache """
+        columns = self.__table_columns(table_name) or {}
+        return {column: type_name for column, (_, type_name) in columns.items()}
+
+    def get_mathlock_columns(self, table_name: str) -> list:
+        """ The method gives names of 'mathlock' typed columns of the table, from the schema cache """
+        mathlock_oid = self.get_mathlock_type_oid()
+        columns = self.__table_columns(table_name) or {}
+        return [column for column, (type_oid, _) in columns.items() if type_oid == mathlock_oid]
+
+    def prefetch_schema(self, schema_name: str = "public") -> int:
+        """ The method loads all tables of the schema with their columns, and OID of 'mathlock' type, into the schema
+        cache by one query. Returns amount of loaded tables """
+        self.cursor.execute("SELECT c.relname, a.attname, a.atttypid, format_type(a.atttypid, a.atttypmod), "
+                            "to_regtype('public.mathlock')::oid FROM pg_catalog.pg_class c "
+                            "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+                            "JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 "
+                            "AND NOT a.attisdropped WHERE n.nspname = %s AND c.relkind IN ('r', 'p') "
+                            "ORDER BY c.relname, a.attnum", (schema_name,))
+        rows = self.cursor.fetchall()
+        tables = {}
+        for table_name, column, type_oid, type_name, mathlock_oid in rows:
+            tables.setdefault(table_name, {})[column] = (type_oid, type_name)
+            self.mathlock_type_oid = mathlock_oid
+        self.schema.update(tables)
+        return len(tables)
+
+    def invalidate_schema(self, table_name: [str, None] = None) -> None:
+        """ The method forgets cached metadata of the table (of all tables by default) """
+        if table_name is None:
+            self.schema.clear()
+        else:
+            self.schema.pop(table_name, None)
+
+    def get_mathlock_type_oid(self) -> [int, None]:
+        """ The method gives OID of 'mathlock' type, to recognize its columns in query results """
+        if self.mathlock_type_oid is None:
+            self.cursor.execute("SELECT to_regtype('public.mathlock')::oid")
+            self.mathlock_type_oid = self.cursor.fetchone()[0]
+
+        return self.mathlock_type_oid
+
+    def iter_rows(self, table_name: str, columns: [Iterable, None] = None, itersize: int = 2000) -> Generator:
+        """ The method streams rows of given table by server-side cursor, fetching 'itersize' rows per round trip, so
+        the whole table is never kept in memory. The connection must not be committed while rows are consumed, and
+        the transaction is left open afterwards - it's up to the caller to commit or roll it back """
+        for _, rows in self.__stream(self.__select_query(table_name, columns), itersize):
+            yield from rows
+
+    def iter_frames(self, table_name: str, columns: [Iterable, None] = None, chunk_size: int = 10000) -> Generator:
+        """ The method streams given table by server-side cursor as DataFrames of up to 'chunk_size' rows, where
+        'mathlock' columns are stored as CiphertextArray. The transaction is left open, like by 'iter_rows' """
+        for description, rows in self.__stream(self.__select_query(table_name, columns), chunk_size):
+            yield self.build_frame(description, rows)
+
+    def decrypt_column(self, table_name: str, column_name: str, chunk_size: int = 1000,
+                       id_range: [tuple, None] = None) -> Generator:
+        """ The method decrypts whole 'mathlock' column (or its inclusive range of IDs) in constant memory, giving pairs
+        (row ID, decryption result). Column is streamed by server-side cursor in chunks, and every chunk is decrypted
+        via REST batch API while the next chunk is being fetched. NULL ciphertexts give None as a result """
+        query = self.__select_query(table_name, ("id", column_name))
+        if id_range is not None:
+            query += " WHERE id BETWEEN %s AND %s"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            for _, rows in self.__stream(query + " ORDER BY id", chunk_size, id_range):
+                ids = [row[0] for row in rows]
+                records = CiphertextArray.from_postgres(row[1] for row in rows).to_records()
+                future = executor.submit(self.__decrypt_records, records)
+                if pending is not None:
+                    yield from zip(pending[0], pending[1].result())
+                pending = (ids, future)
+
+            if pending is not None:
+                yield from zip(pending[0], pending[1].result())
+        self.conn.commit()
+
     def get_all_tables_info(self) -> list:
         """ The method gives all public tables available in the db """
         self.cursor.execute(f"SELECT * FROM pg_catalog.pg_tables WHERE schemaname != 'pg_catalog'"
@@ -84,127 +242,524 @@ class MathLockPostgresSample:
                     print(x)
             return rows
 
-        print("Nothing to fetch, table is empty")
+        self.log("Nothing to fetch, table is empty")
         return None
 
     def select_math_result_by_row_id(self, table_name: str, row_id: int, column_name: str) -> dict:
         """ The method performs select by a record ID. Generally we store math. operations result into column N3 """
-        self.cursor.execute(f"SELECT {column_name} FROM {table_name} WHERE id = {row_id}")
+        self.__execute(table_name, f"select_{column_name}", f"SELECT {column_name} FROM {table_name} WHERE id = %s",
+                       (row_id,))
         res = self.cursor.fetchall()
-        print(f"Fetched result by ID: {row_id}, from table: [{table_name}], after math operation: {column_name},"
-              f"ciphertext is: {res}")
+        self.log(f"Fetched result by ID: {row_id}, from table: [{table_name}], after math operation: {column_name},"
+                 f"ciphertext is: {res}")
 
         return self.prepare_data_for_decryption(res)
 
-    def is_table_exists(self, table_name: str) -> bool:
-        """ The method validates whether table exists or not """
-        cmd = f"SELECT * FROM information_schema.tables WHERE table_name = '{table_name}'"
-        self.cursor.execute(cmd)
-        info = self.cursor.fetchone()
-        if info:
-            return True
+    def select_math_results_by_row_id(self, table_name: str, row_id: int) -> dict:
+        """ The method fetches results of all 4 FHE operations of the row by one select, prepared for decryption.
+        Gives {operation: ciphertext}, where operations without result are omitted """
+        columns = ", ".join(column for column, _ in self.math_operations.values())
+        self.__execute(table_name, "select_results", f"SELECT {columns} FROM {table_name} WHERE id = %s", (row_id,))
+        row = self.cursor.fetchone() or [None] * len(self.math_operations)
+        return {operation: Ciphertext.from_postgres(value).to_dict()
+                for operation, value in zip(self.math_operations, row) if value is not None}
 
-        return False
+    def is_table_exists(self, table_name: str) -> bool:
+        """ The method validates whether table exists or not, by the schema cache """
+        return self.__table_columns(table_name) is not None
 
     def create_mathlock_table(self, table_name: str) -> bool:
         """ The method creates a table by given name """
         if not table_name:
-            print("Table name is None, PLEASE DEFINE YOUR UNIQUE TABLE NAME... terminating")
+            self.log("Table name is None, PLEASE DEFINE YOUR UNIQUE TABLE NAME... terminating")
             sys.exit(1)
 
         if not self.is_lower_case(table_name):
             sys.exit(1)
 
         if not self.is_table_exists(table_name):
+            self.invalidate_statements(table_name)
             cmd = f"CREATE TABLE IF NOT EXISTS public.{table_name} (id integer NOT NULL, " \
                   f"{self.number1} public.mathlock, {self.number2} public.mathlock, {self.mult_result} public.mathlock," \
                   f"{self.div_result} public.mathlock, {self.add_result} public.mathlock, " \
                   f"{self.sub_result} public.mathlock);"
             self.cursor.execute(cmd)
             self.conn.commit()
+            self.invalidate_schema(table_name)
             res = self.is_table_exists(table_name)
-            print(f"Table: [{table_name}] has been created successfully: {res}")
+            self.log(f"Table: [{table_name}] has been created successfully: {res}")
             return res
 
-        print(f"Table: [{table_name}] already exists")
+        self.log(f"Table: [{table_name}] already exists")
         return True
 
     def insert_into_table(self, table_name: str, index: int, m1: str, m2: str) -> None:
         """ The method performs insertion into given table for Column 1,2 by any index. Where column 1 and 2
         are ciphertext of Matrix 1 and ciphertext of Matrix 2 """
-        cmd = f"INSERT INTO public.{table_name} (id, {self.number1}, {self.number2}) VALUES ({index}, '{m1}', '{m2}');"
-        self.cursor.execute(cmd)
+        cmd = f"INSERT INTO public.{table_name} (id, {self.number1}, {self.number2}) VALUES (%s, %s, %s);"
+        self.__execute(table_name, "insert", cmd, (index, m1, m2))
         self.conn.commit()
 
+    def bulk_insert(self, table_name: str, rows: Iterable, batch_size: int = 10000, use_copy: bool = True) -> int:
+        """ The method loads rows (id, m1, m2) into given table for Column 1,2, where m1 and m2 are ciphertexts - REST
+        API json, Ciphertext or already built Postgres string, None gives NULL. Rows may come from any iterable or
+        generator, they are streamed via COPY ... FROM STDIN (or multi-row INSERT by execute_values, if 'use_copy' is
+        False) in batches of 'batch_size' rows, one transaction per batch. Returns amount of inserted rows """
+        columns = f"public.{table_name} (id, {self.number1}, {self.number2})"
+        inserted = 0
+        for batch in self.__batches(rows, batch_size):
+            batch = [(index, self.__to_postgres_literal(m1), self.__to_postgres_literal(m2)) for index, m1, m2 in batch]
+            try:
+                with self.metrics.span("sql", "bulk_insert"):
+                    if use_copy:
+                        # missing ciphertexts are NULL ('\N' in COPY text format), the same way as by execute_values
+                        data = io.StringIO("".join(f"{index}\t{self.__copy_value(m1)}\t{self.__copy_value(m2)}\n"
+                                                   for index, m1, m2 in batch))
+                        self.cursor.copy_expert(f"COPY {columns} FROM STDIN", data)
+                    else:
+                        psycopg2.extras.execute_values(self.cursor, f"INSERT INTO {columns} VALUES %s", batch,
+                                                       page_size=len(batch))
+                    self.conn.commit()
+            except (Exception, psycopg2.DatabaseError):
+                self.conn.rollback()
+                raise
+            inserted += len(batch)
+
+        return inserted
+
+    def compare_insert_performance(self, table_name: str, rows: list, batch_size: int = 10000) -> dict:
+        """ The method measures rows/sec of per-row 'insert_into_table', 'bulk_insert' via COPY and via execute_values
+        for the same rows. IMPORTANT: the table is truncated before every run """
+        rows = [(index, self.__to_postgres_literal(m1), self.__to_postgres_literal(m2)) for index, m1, m2 in rows]
+        runs = {"per-row INSERT": lambda: [self.insert_into_table(table_name, *row) for row in rows],
+                "COPY": lambda: self.bulk_insert(table_name, rows, batch_size),
+                "execute_values": lambda: self.bulk_insert(table_name, rows, batch_size, use_copy=False)}
+        results = {}
+        for name, run_insert in runs.items():
+            self.cursor.execute(f"TRUNCATE public.{table_name}")
+            self.conn.commit()
+            start_time = time.perf_counter()
+            run_insert()
+            results[name] = len(rows) / (time.perf_counter() - start_time)
+            self.log(f"{name}: {results[name]:.1f} rows/sec for {len(rows)} rows")
+
+        return results
+
     def drop_mathlock_table(self, table_name: str) -> bool:
         """ The method drops existing table by given name """
         if not table_name:
-            print("Table name is None, PLEASE DEFINE YOUR UNIQUE TABLE NAME... terminating")
+            self.log("Table name is None, PLEASE DEFINE YOUR UNIQUE TABLE NAME... terminating")
             sys.exit(1)
 
         if not self.is_lower_case(table_name):
             sys.exit(1)
 
+        self.invalidate_statements(table_name)
         self.cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
         self.conn.commit()
+        self.invalidate_schema(table_name)
         if not self.is_table_exists(table_name):
-            print(f"\nTable: [{table_name}] has been deleted successfully")
+            self.log(f"\nTable: [{table_name}] has been deleted successfully")
             return True
 
-        print(f"\nTable: [{table_name}] can't be deleted, or doesn't exists")
+        self.log(f"\nTable: [{table_name}] can't be deleted, or doesn't exists")
         return False
 
     def delete_row(self, table_name: str, row_id: int) -> int:
         """ The method deletes row (record) by given ID and returns amount of deleted rows """
         rows_deleted = 0
         try:
-            self.cursor.execute(f"DELETE FROM {table_name} WHERE id = '{row_id}'")
+            self.__execute(table_name, "delete", f"DELETE FROM {table_name} WHERE id = %s", (row_id,))
             rows_deleted = self.cursor.rowcount
             self.conn.commit()
         except (Exception, psycopg2.DatabaseError) as exc:
-            print(f"Inner delete exception: {exc}")
+            self.log(f"Inner delete exception: {exc}")
 
         return rows_deleted
 
     def homomorphic_multiplication(self, table_name: str, row_id: int) -> None:
         """ The method performs FHE matrix multiplication inside Postgres by our custom extension, using given table name
          and row (record) ID """
-        print(f"Called FHE Multiplication operation for the table: {table_name} row ID {row_id}")
-        cmd = f"UPDATE public.{table_name} SET {self.mult_result} = {self.number1} * {self.number2} WHERE id = {row_id};"
-        self.cursor.execute(cmd)
+        self.log(f"Called FHE Multiplication operation for the table: {table_name} row ID {row_id}")
+        self.__execute_math(table_name, "multiplication", row_id)
         self.conn.commit()
 
     def homomorphic_division(self, table_name, row_id) -> None:
         """ The method performs FHE matrix division inside Postgres by our custom extension, using given table name
         and row (record) ID """
-        print(f"Called FHE Division operation for the table: {table_name} row ID {row_id}")
-        cmd = f"UPDATE public.{table_name} SET {self.div_result} = {self.number1} / {self.number2} WHERE id = {row_id};"
-        self.cursor.execute(cmd)
+        self.log(f"Called FHE Division operation for the table: {table_name} row ID {row_id}")
+        self.__execute_math(table_name, "division", row_id)
         self.conn.commit()
 
     def homomorphic_addition(self, table_name, row_id) -> None:
         """ The method performs FHE matrix addition inside Postgres by our custom extension, using given table name
          and row (record) ID """
-        print(f"Called FHE Addition operation for the table: {table_name} row ID {row_id}")
-        cmd = f"UPDATE public.{table_name} SET {self.add_result} = {self.number1} + {self.number2} WHERE id = {row_id};"
-        self.cursor.execute(cmd)
+        self.log(f"Called FHE Addition operation for the table: {table_name} row ID {row_id}")
+        self.__execute_math(table_name, "addition", row_id)
         self.conn.commit()
 
     def homomorphic_subtraction(self, table_name, row_id) -> None:
         """ The method performs FHE matrix subtraction inside Postgres by our custom extension, using given table name
          and row (record) ID """
-        print(f"Called FHE Subtraction operation for the table: {table_name} row ID {row_id}")
-        cmd = f"UPDATE public.{table_name} SET {self.sub_result} = {self.number1} - {self.number2} WHERE id = {row_id};"
-        self.cursor.execute(cmd)
+        self.log(f"Called FHE Subtraction operation for the table: {table_name} row ID {row_id}")
+        self.__execute_math(table_name, "subtraction", row_id)
+        self.conn.commit()
+
+    def invalidate_statements(self, table_name: [str, None] = None) -> None:
+        """ The method forgets PREPAREd statements of the table (of all tables by default) on all connections, and
+        deallocates them on the own connection. Statements on pooled connections are prepared again under new names """
+        for key in [key for key in list(self.statements) if table_name is None or key[1] == table_name]:
+            name = self.statements.pop(key, None)
+            if name is not None and key[0] is self.conn and not self.conn.closed:
+                self.cursor.execute(f"DEALLOCATE {name}")
+
+    def compare_statement_performance(self, table_name: str, row_id: int, operation: str = "multiplication",
+                                      iterations: int = 1000) -> dict:
+        """ The method measures FHE operation over the row repeated in a hot loop, like 'execute_operation_in_a_loop',
+        with plain and with PREPAREd statement: wall time of the loop and planning time reported by Postgres
+        (EXPLAIN ANALYZE), which is what prepared statement saves. IMPORTANT: the operation is really executed """
+        column, operator = self.math_operations[operation]
+        explain = "EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) "
+        prepared_statements = self.prepared_statements
+        results = {}
+        try:
+            for mode, prepared in (("plain", False), ("prepared", True)):
+                self.prepared_statements = prepared
+                start_time = time.perf_counter()
+                for _ in range(iterations):
+                    self.__execute_math(table_name, operation, row_id)
+                    self.conn.commit()
+                seconds = time.perf_counter() - start_time
+
+                if prepared:
+                    name = self.statements[(self.conn, table_name, operation)]
+                    self.cursor.execute(f"{explain}EXECUTE {name} (%s)", (row_id,))
+                else:
+                    self.cursor.execute(f"{explain}UPDATE public.{table_name} SET {column} = {self.number1} {operator} "
+                                        f"{self.number2} WHERE id = %s;", (row_id,))
+                plan = self.cursor.fetchone()[0][0]
+                self.conn.commit()
+                results[mode] = {"seconds": seconds, "ops_per_sec": iterations / seconds if seconds else 0.0,
+                                 "planning_ms": plan["Planning Time"], "execution_ms": plan["Execution Time"]}
+                self.log(f"{mode}: {iterations} x {operation} took {seconds:.5f} seconds, planning "
+                         f"{plan['Planning Time']:.3f} ms, execution {plan['Execution Time']:.3f} ms per statement")
+        finally:
+            self.prepared_statements = prepared_statements
+
+        saved = results["plain"]["planning_ms"] - results["prepared"]["planning_ms"]
+        results["planning_ms_saved"] = saved * iterations
+        self.log(f"Planning time saved by prepared statement: {results['planning_ms_saved']:.3f} ms "
+                 f"per {iterations} calls")
+        return results
+
+    def homomorphic_compute(self, table_name: str, operations: [Iterable, None] = None, id_range: [tuple, None] = None,
+                            ids: [Iterable, None] = None, chunk_size: int = 10000) -> list:
+        """ The method performs any subset of 4 FHE matrix operations (all of them by default) inside Postgres by our
+        custom extension with one UPDATE per chunk of rows, writing all requested result columns in a single pass.
+        Rows are either the whole table, inclusive range of IDs (first, last), or list of IDs. Every chunk of up to
+        'chunk_size' rows is committed separately, to keep locks and WAL volume bounded. Returns timing of every chunk,
+        empty list of operations raises ValueError. When all 4 operations are computed over the table with result
+        tracking (see 'enable_result_tracking'), dirty flag of the rows is cleared as by 'refresh_results' """
+        operations = list(self.math_operations) if operations is None else list(operations)
+        if not operations:
+            raise ValueError(f"No FHE operations given, available are: {list(self.math_operations)}")
+        unknown = set(operations) - set(self.math_operations)
+        if unknown:
+            raise ValueError(f"Unknown FHE operations: {unknown}, available are: {list(self.math_operations)}")
+
+        assignments = ", ".join(f"{column} = {self.number1} {operator} {self.number2}"
+                                for column, operator in (self.math_operations[ops] for ops in operations))
+        if set(operations) == set(self.math_operations) and self.results_dirty in self.get_column_types(table_name):
+            assignments += f", {self.results_dirty} = false"
+        self.log(f"Called FHE {', '.join(operations)} operations for the table: {table_name}")
+        timings = []
+        for condition, params in self.__id_chunks(table_name, id_range, ids, chunk_size):
+            start_time = time.perf_counter()
+            with self.metrics.span("sql", "compute"):
+                self.cursor.execute(f"UPDATE public.{table_name} SET {assignments} WHERE {condition};", params)
+            rows = self.cursor.rowcount
+            self.conn.commit()
+            timings.append({"chunk": params, "rows": rows, "seconds": time.perf_counter() - start_time})
+
+        return timings
+
+    def enable_result_tracking(self, table_name: str) -> None:
+        """ The method adds dirty flag column into the table (set for all existing rows), with a trigger, which sets it
+        whenever number1 or number2 of a row is changed, and partial index of dirty rows. New rows are dirty by
+        default. The flag is cleared by 'refresh_results' and by 'homomorphic_compute' of all 4 operations, while
+        single operations ('homomorphic_multiplication' etc.) keep it, since other results of the row may be stale.
+        The method is idempotent and is called by 'refresh_results' on the first need """
+        self.cursor.execute("CREATE OR REPLACE FUNCTION public.mathlock_mark_results_dirty() RETURNS trigger AS "
+                            f"$$ BEGIN NEW.{self.results_dirty} := true; RETURN NEW; END $$ LANGUAGE plpgsql")
+        self.cursor.execute(f"ALTER TABLE public.{table_name} ADD COLUMN IF NOT EXISTS {self.results_dirty} boolean "
+                            f"NOT NULL DEFAULT true")
+        self.cursor.execute(f"DROP TRIGGER IF EXISTS {table_name}_results_dirty ON public.{table_name}")
+        self.cursor.execute(f"CREATE TRIGGER {table_name}_results_dirty BEFORE UPDATE OF {self.number1}, "
+                            f"{self.number2} ON public.{table_name} FOR EACH ROW WHEN "
+                            f"(OLD.{self.number1}::text IS DISTINCT FROM NEW.{self.number1}::text OR "
+                            f"OLD.{self.number2}::text IS DISTINCT FROM NEW.{self.number2}::text) "
+                            f"EXECUTE PROCEDURE public.mathlock_mark_results_dirty()")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_results_dirty_idx ON public.{table_name} (id) "
+                            f"WHERE {self.results_dirty}")
         self.conn.commit()
+        self.invalidate_schema(table_name)
+
+    def refresh_results(self, table_name: str, batch_size: int = 10000, full_rebuild: bool = False) -> dict:
+        """ The method recomputes all 4 FHE results only for dirty rows - inserted, or whose number1/number2 were
+        changed since the last refresh - in batches of up to 'batch_size' rows, one transaction per batch, clearing
+        their flag. Dirty rows locked by another refresh are skipped, so several workers may refresh the same table.
+        With 'full_rebuild' all rows are recomputed by ID ranges, e.g. for recovery. Returns amount of recomputed
+        rows, batches and seconds """
+        if self.results_dirty not in self.get_column_types(table_name):
+            self.enable_result_tracking(table_name)
+
+        assignments = ", ".join(f"{column} = {self.number1} {operator} {self.number2}"
+                                for column, operator in self.math_operations.values())
+        update = f"UPDATE public.{table_name} SET {assignments}, {self.results_dirty} = false WHERE "
+        if full_rebuild:
+            chunks = ((update + condition, params)
+                      for condition, params in self.__id_chunks(table_name, None, None, batch_size))
+        else:
+            dirty = f"SELECT id FROM public.{table_name} WHERE {self.results_dirty} ORDER BY id LIMIT %s " \
+                    f"FOR UPDATE SKIP LOCKED"
+            chunks = itertools.repeat((f"{update}{self.results_dirty} AND id IN ({dirty})", (batch_size,)))
+
+        start_time = time.perf_counter()
+        rows, batches = 0, 0
+        for query, params in chunks:
+            try:
+                with self.metrics.span("sql", "refresh"):
+                    self.cursor.execute(query, params)
+                    updated = self.cursor.rowcount
+                    self.conn.commit()
+            except (Exception, psycopg2.DatabaseError):
+                self.conn.rollback()
+                raise
+            if not updated and not full_rebuild:
+                break
+            rows += updated
+            batches += 1
+
+        seconds = time.perf_counter() - start_time
+        self.log(f"Refreshed results of {rows} rows of the table: [{table_name}] by {batches} batches in "
+                 f"{seconds:.5f} seconds")
+        return {"rows": rows, "batches": batches, "seconds": seconds}
+
+    def create_aggregates(self) -> None:
+        """ The method creates aggregates mathlock_sum and mathlock_product over 'mathlock' type, built on '+' and '*'
+        operators of our extension, so reductions over many rows are computed inside Postgres by one statement.
+        Only missing aggregates are created, existing ones are never dropped, since they may be in use by other users
+        of the shared database """
+        for name, operator in (("sum", "+"), ("product", "*")):
+            self.cursor.execute("SELECT to_regprocedure(%s) IS NOT NULL", (f"public.mathlock_{name}(public.mathlock)",))
+            if self.cursor.fetchone()[0]:
+                continue
+
+            self.cursor.execute(f"CREATE OR REPLACE FUNCTION public.mathlock_{name}_step(public.mathlock, "
+                                f"public.mathlock) RETURNS public.mathlock AS 'SELECT $1 {operator} $2' "
+                                f"LANGUAGE sql IMMUTABLE STRICT")
+            self.cursor.execute(f"CREATE AGGREGATE public.mathlock_{name}(public.mathlock) "
+                                f"(SFUNC = public.mathlock_{name}_step, STYPE = public.mathlock)")
+        self.conn.commit()
+        self.aggregates_created = True
+
+    def encrypted_sum(self, table_name: str, column_name: str, where: [str, None] = None,
+                      group_by: [str, Iterable, None] = None, params: [tuple, None] = None) -> [dict, None]:
+        """ The method sums ciphertexts of the column inside Postgres, giving one ciphertext to decrypt (None for no
+        rows). Optional 'where' is SQL condition with %s placeholders for 'params'. With 'group_by' (column or list
+        of columns) it gives {group: ciphertext}, where group is a value, or a tuple for several columns """
+        return self.__aggregate(table_name, [f"public.mathlock_sum({column_name})"], where, group_by, params)
+
+    def encrypted_product(self, table_name: str, column_name: str, where: [str, None] = None,
+                          group_by: [str, Iterable, None] = None, params: [tuple, None] = None) -> [dict, None]:
+        """ The method multiplies ciphertexts of the column inside Postgres, the same way as 'encrypted_sum' """
+        return self.__aggregate(table_name, [f"public.mathlock_product({column_name})"], where, group_by, params)
+
+    def encrypted_dot_product(self, table_name: str, column1: str, column2: str, where: [str, None] = None,
+                              group_by: [str, Iterable, None] = None, params: [tuple, None] = None) -> [dict, None]:
+        """ The method computes dot product of 2 columns - sum of their products by rows - inside Postgres, the same
+        way as 'encrypted_sum' """
+        return self.__aggregate(table_name, [f"public.mathlock_sum({column1} * {column2})"], where, group_by, params)
+
+    def encrypted_mean(self, table_name: str, column_name: str, where: [str, None] = None,
+                       group_by: [str, Iterable, None] = None, params: [tuple, None] = None) -> [dict, None]:
+        """ The method gives {"sum": ciphertext, "count": amount of values} of the column by one statement, the same
+        way as 'encrypted_sum' - the mean is the decrypted sum divided by count, see 'decrypt_mean' """
+        return self.__aggregate(table_name, [f"public.mathlock_sum({column_name})", f"count({column_name})"], where,
+                                group_by, params, names=("sum", "count"))
+
+    def decrypt_mean(self, mean: [dict, None]) -> [float, None]:
+        """ The method decrypts the result of 'encrypted_mean' (of a single group) and gives the mean value """
+        if not mean or not mean["count"]:
+            return None
+
+        return float(self.rest_sample.do_decryption(mean["sum"])["value"]) / mean["count"]
+
+    @contextmanager
+    def pooled_worker(self) -> Generator:
+        """ The method gives a copy of this sample bound to its own connection from the pool, so it can be used by
+        a separate thread. The connection is returned into the pool afterwards """
+        if self.pool is None:
+            raise RuntimeError("Connection pool isn't created, please define 'pool_size'")
+
+        pool, pool_slots = self.pool, self.pool_slots
+        pool_slots.acquire()  # psycopg2 pool raises PoolError when exhausted, so wait for a free connection here
+        try:
+            conn = pool.getconn()
+        except Exception:
+            pool_slots.release()
+            raise
+        conn.metrics = self.metrics
+        worker = copy.copy(self)
+        worker.conn = conn
+        worker.cursor = conn.cursor()
+        try:
+            yield worker
+        finally:
+            worker.cursor.close()
+            pool.putconn(conn)
+            pool_slots.release()
+
+    def ensure_pool(self, size: int) -> None:
+        """ The method creates connection pool of the given size, if it isn't created yet or is smaller. So it shall
+        not be called while pooled workers are in use """
+        if self.pool is not None and self.pool.maxconn < size:
+            self.pool.closeall()
+            self.pool = None
+            # statements prepared on closed pooled connections are gone together with them
+            for key in [key for key in list(self.statements) if key[0] is not self.conn]:
+                self.statements.pop(key, None)
+        if self.pool is None:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(1, max(1, size), **self.connect_params)
+            self.pool_slots = threading.BoundedSemaphore(self.pool.maxconn)
+
+    def run_partitioned(self, table_name: str, action, workers: int = 4, id_range: [tuple, None] = None,
+                        partitions: [int, None] = None) -> dict:
+        """ The method splits the table (or given inclusive range of IDs) into 'partitions' ID ranges (one per worker
+        by default), and runs action(worker, first_id, last_id) for every range in a thread pool, where every worker
+        is a copy of this sample with its own pooled connection (the pool is extended to 'workers' connections if it's
+        smaller). Action returns amount of processed rows.
+        Returns aggregate report, including throughput in rows/sec """
+        self.ensure_pool(workers)
+        if id_range is None:
+            self.cursor.execute(f"SELECT min(id), max(id) FROM public.{table_name}")
+            id_range = self.cursor.fetchone()
+            self.conn.commit()
+            if id_range[0] is None:
+                self.log(f"Nothing to process, table: [{table_name}] is empty")
+                return {"partitions": [], "rows": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+
+        def run_partition(partition: tuple) -> dict:
+            start_time = time.perf_counter()
+            with self.pooled_worker() as worker:
+                rows = action(worker, *partition)
+            return {"range": partition, "rows": rows, "seconds": time.perf_counter() - start_time}
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reports = list(executor.map(run_partition, self.__split_range(id_range, partitions or workers)))
+        seconds = time.perf_counter() - start_time
+
+        rows = sum(report["rows"] for report in reports)
+        rows_per_sec = rows / seconds if seconds else 0.0
+        self.log(f"Processed {rows} rows of the table: [{table_name}] by {workers} workers in {seconds:.5f} seconds, "
+                 f"{rows_per_sec:.1f} rows/sec")
+        return {"partitions": reports, "rows": rows, "seconds": seconds, "rows_per_sec": rows_per_sec}
+
+    def parallel_bulk_insert(self, table_name: str, rows_for_range, id_range: tuple, workers: int = 4,
+                             batch_size: int = 10000) -> dict:
+        """ The method ingests rows in parallel, where rows_for_range(first_id, last_id) gives rows (id, m1, m2) of
+        one partition - e.g. encrypting source values of these IDs - loaded by 'bulk_insert' of its worker """
+        return self.run_partitioned(table_name, lambda worker, first, last: worker.bulk_insert(
+            table_name, rows_for_range(first, last), batch_size), workers, id_range)
+
+    def parallel_compute(self, table_name: str, operations: [Iterable, None] = None, workers: int = 4,
+                         chunk_size: int = 10000, id_range: [tuple, None] = None) -> dict:
+        """ The method performs FHE operations by 'homomorphic_compute' over the table split between parallel workers,
+        so computation is spread over several Postgres backends """
+        def compute(worker, first: int, last: int) -> int:
+            timings = worker.homomorphic_compute(table_name, operations, id_range=(first, last), chunk_size=chunk_size)
+            return sum(timing["rows"] for timing in timings)
+
+        return self.run_partitioned(table_name, compute, workers, id_range)
+
+    def parallel_decrypt(self, table_name: str, column_name: str, workers: int = 4, chunk_size: int = 1000,
+                         id_range: [tuple, None] = None, on_result=None) -> dict:
+        """ The method fetches and decrypts 'mathlock' column by 'decrypt_column' split between parallel workers.
+        Every pair (row ID, decryption result) is given to on_result(row_id, result), which must be thread-safe, or if
+        it's not defined, all results are collected into report as "results": {row ID: decryption result} """
+        results = {}
+        consume = on_result if on_result is not None else results.__setitem__
+
+        def decrypt(worker, first: int, last: int) -> int:
+            rows = 0
+            for row_id, result in worker.decrypt_column(table_name, column_name, chunk_size, (first, last)):
+                consume(row_id, result)
+                rows += 1
+            return rows
+
+        report = self.run_partitioned(table_name, decrypt, workers, id_range)
+        if on_result is None:
+            report["results"] = results
+
+        return report
+
+    def run_pipeline(self, table_name: str, pairs: Iterable, rest_workers: int = 8, db_workers: int = 4,
+                     queue_size: int = 100, on_result=None) -> dict:
+        """ The method streams pairs (row ID, value1, value2) through staged pipeline: encrypt (REST API) -> insert ->
+        compute all 4 FHE operations -> fetch results -> decrypt (REST API), so REST calls of some rows overlap with
+        SQL of other rows. REST stages are run by 'rest_workers' threads each, DB stages by 'db_workers' threads each,
+        every DB thread over its own pooled connection, so the pool is extended to fit all of them. Every result
+        (row ID, {operation: decryption result}) is given to on_result(result), or collected into report as "results".
+        Returns report of the pipeline with per-stage throughput and queue depth """
+        self.ensure_pool(db_workers * 3)
+
+        def encrypt(pair: tuple) -> tuple:
+            row_id, value1, value2 = pair
+            return row_id, self.rest_sample.do_encryption(value1), self.rest_sample.do_encryption(value2)
+
+        def insert(worker, row: tuple) -> int:
+            row_id, encrypted1, encrypted2 = row
+            worker.insert_into_table(table_name, row_id, worker.build_string_for_postgres(encrypted1),
+                                     worker.build_string_for_postgres(encrypted2))
+            return row_id
+
+        def compute(worker, row_id: int) -> int:
+            worker.homomorphic_compute(table_name, ids=[row_id])
+            return row_id
+
+        def fetch(worker, row_id: int) -> tuple:
+            results = worker.select_math_results_by_row_id(table_name, row_id)
+            worker.conn.commit()
+            return row_id, results
+
+        def decrypt(row: tuple) -> tuple:
+            row_id, results = row
+            return row_id, {ops: self.rest_sample.do_decryption(result) for ops, result in results.items()}
+
+        pipeline = sample_pipeline.Pipeline(queue_size, self.log) \
+            .add_stage("encrypt", encrypt, rest_workers) \
+            .add_stage("insert", insert, db_workers, context=self.pooled_worker) \
+            .add_stage("compute", compute, db_workers, context=self.pooled_worker) \
+            .add_stage("fetch", fetch, db_workers, context=self.pooled_worker) \
+            .add_stage("decrypt", decrypt, rest_workers)
+        return pipeline.run(pairs, on_result)
+
+    def close(self) -> None:
+        """ The method closes the connection, all pooled connections and the REST API sample """
+        self.statements.clear()
+        if self.pool is not None:
+            self.pool.closeall()
+        self.conn.close()
+        self.rest_sample.close()
 
     def execute_operation_in_a_loop(self, action: type, iterator: int, table_name: str, row_id: int) -> None:
         """ The method performs operation in a loop using for input required method's name, measuring performance """
         start_time = arrow.now()
         for i in range(iterator):
             action(table_name, row_id)
-        end_time = float(f"{(arrow.now() - start_time).microseconds / 1000000:.5f}")
-        print(f"Execution took: {end_time} seconds")
+        end_time = float(f"{(arrow.now() - start_time).total_seconds():.5f}")
+        self.log(f"Execution took: {end_time} seconds")
 
     def rest_do_encryption(self, value: [int, str]) -> dict:
         """ The method performs Fully Homomorphic Encryption operation using our other sample for REST API """
@@ -213,26 +768,180 @@ class MathLockPostgresSample:
     def rest_do_decryption(self, m1: dict, ops_type: str) -> dict:
         """ The method performs Fully Homomorphic Decryption operation using our other sample for REST API """
         res = self.rest_sample.do_decryption(m1)
-        print(f"Result after decryption for {ops_type} is: {res['value']}")
+        self.log(f"Result after decryption for {ops_type} is: {res['value']}")
         return res
 
     def build_string_for_postgres(self, value: dict) -> str:
         """ String builder to match to some specific syntax """
-        return f"{'{'}{value['a']},{value['b']},{value['c']},{value['d']}{'}'}"
+        return Ciphertext.from_dict(value).to_postgres()
 
     def prepare_data_for_decryption(self, data: dict) -> dict:
         """ The method prepares data for decryption via REST API """
-        rebuild_string = str(data[0][0]).replace('{', '').replace('}', '').split(",", 4)
-        return {"a": rebuild_string[0], "b": rebuild_string[1], "c": rebuild_string[2], "d": rebuild_string[3]}
+        return Ciphertext.from_postgres(data[0][0]).to_dict()
 
     # endregion
 
     # region private protected methods
 
+    def __table_columns(self, table_name: str) -> [dict, None]:
+        """ The method gives {column: (type OID, type name)} of the table, or None if it doesn't exist. It's read from
+        the catalog (table is resolved the same way as in queries) once, and then taken from the schema cache. Only
+        tables count, like in 'prefetch_schema' - not views, indexes or sequences of the same name """
+        if table_name in self.schema:
+            return self.schema[table_name]
+
+        self.cursor.execute("SELECT c.oid IS NOT NULL, a.attname, a.atttypid, format_type(a.atttypid, a.atttypmod) "
+                            "FROM (SELECT to_regclass(%s)::oid AS oid) t LEFT JOIN pg_catalog.pg_class c "
+                            "ON c.oid = t.oid AND c.relkind IN ('r', 'p') LEFT JOIN pg_catalog.pg_attribute a "
+                            "ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped ORDER BY a.attnum",
+                            (table_name,))
+        rows = self.cursor.fetchall()
+        columns = {column: (type_oid, type_name) for _, column, type_oid, type_name in rows if column is not None}
+        self.schema[table_name] = columns if rows[0][0] else None
+        return self.schema[table_name]
+
+    def __aggregate(self, table_name: str, expressions: list, where: [str, None], group_by: [str, Iterable, None],
+                    params: [tuple, None], names: [tuple, None] = None) -> [dict, None]:
+        """ The method computes aggregate expressions over the table by one statement. A single expression gives a
+        ciphertext, several ones give dict by 'names', where ciphertexts are prepared for decryption """
+        if not self.aggregates_created:
+            self.create_aggregates()
+
+        group_by = [] if group_by is None else [group_by] if isinstance(group_by, str) else list(group_by)
+        query = f"SELECT {', '.join(group_by + expressions)} FROM public.{table_name}"
+        if where:
+            query += f" WHERE {where}"
+        if group_by:
+            query += f" GROUP BY {', '.join(group_by)}"
+
+        with self.metrics.span("sql", "aggregate"):
+            self.cursor.execute(query, params)
+            rows = self.cursor.fetchall()
+        self.conn.commit()
+
+        def convert(values: tuple) -> [dict, None]:
+            values = [Ciphertext.from_postgres(value).to_dict() if isinstance(value, str) else value
+                      for value in values]
+            return values[0] if names is None else dict(zip(names, values))
+
+        if not group_by:
+            return convert(rows[0]) if rows and rows[0][0] is not None else None
+
+        keys = len(group_by)
+        return {row[0] if keys == 1 else tuple(row[:keys]): convert(row[keys:]) for row in rows}
+
+    def __execute(self, table_name: str, operation: str, query: str, params: tuple) -> None:
+        """ The method executes parameterized query (with %s placeholders) of the operation over the table. Unless
+        prepared statements are disabled, the query is PREPAREd once per connection and then called by EXECUTE """
+        with self.metrics.span("sql", operation):
+            if not self.prepared_statements:
+                self.cursor.execute(query, params)
+            else:
+                self.__execute_prepared(table_name, operation, query, params)
+
+    def __execute_prepared(self, table_name: str, operation: str, query: str, params: tuple) -> None:
+        """ The method executes the query of the operation by EXECUTE, preparing it on the first call """
+        key = (self.conn, table_name, operation)
+        name = self.statements.get(key)
+        if name is None:
+            name = f"mathlock_stmt_{next(self.__statement_ids)}"
+            parts = query.split("%s")
+            statement = parts[0] + "".join(f"${index}{part}" for index, part in enumerate(parts[1:], 1))
+            self.cursor.execute(f"PREPARE {name} AS {statement}")
+            self.statements[key] = name
+
+        self.cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+    def __execute_math(self, table_name: str, operation: str, row_id: int) -> None:
+        """ The method executes FHE operation over the row, writing the result into its column """
+        column, operator = self.math_operations[operation]
+        self.__execute(table_name, operation, f"UPDATE public.{table_name} SET {column} = {self.number1} {operator} "
+                                              f"{self.number2} WHERE id = %s;", (row_id,))
+
+    @staticmethod
+    def __batches(rows: Iterable, batch_size: int) -> Generator:
+        """ The method splits any iterable into lists of up to 'batch_size' items """
+        rows = iter(rows)
+        batch = list(islice(rows, batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(rows, batch_size))
+
+    def __id_chunks(self, table_name: str, id_range: [tuple, None], ids: [Iterable, None],
+                    chunk_size: int) -> Generator:
+        """ The method splits rows into chunks of up to 'chunk_size' rows by IDs, giving for every chunk SQL condition
+        and its params. Ranges of IDs are paginated by keyset - the last ID of every chunk is looked up by the query -
+        so sparse IDs don't give empty chunks """
+        if ids is not None:
+            for batch in self.__batches(ids, chunk_size):
+                yield "id = ANY(%s)", (batch,)
+            return
+
+        if id_range is None:
+            self.cursor.execute(f"SELECT min(id), max(id) FROM public.{table_name}")
+            id_range = self.cursor.fetchone()
+            if id_range[0] is None:
+                return  # empty table
+
+        first, last = id_range
+        while first <= last:
+            self.cursor.execute(f"SELECT id FROM public.{table_name} WHERE id BETWEEN %s AND %s ORDER BY id "
+                                f"OFFSET %s LIMIT 1", (first, last, chunk_size - 1))
+            row = self.cursor.fetchone()
+            chunk_last = last if row is None else row[0]  # less than 'chunk_size' rows are left
+            yield "id BETWEEN %s AND %s", (first, chunk_last)
+            first = chunk_last + 1
+
+    @staticmethod
+    def __split_range(id_range: tuple, partitions: int) -> list:
+        """ The method splits inclusive range of IDs into up to 'partitions' contiguous ranges """
+        first, last = id_range
+        size = max(1, math.ceil((last - first + 1) / partitions))
+        return [(start, min(start + size - 1, last)) for start in range(first, last + 1, size)]
+
+    def __select_query(self, table_name: str, columns: [Iterable, None]) -> str:
+        """ The method builds query selecting given columns (all by default) of the table """
+        return f"SELECT {', '.join(columns) if columns else '*'} FROM public.{table_name}"
+
+    def __stream(self, query: str, chunk_size: int, params: [tuple, None] = None) -> Generator:
+        """ The method executes query by named (server-side) cursor, giving its description and rows chunk by chunk.
+        Only the cursor is closed afterwards, the transaction is committed by the caller """
+        cursor = self.conn.cursor(name=f"mathlock_stream_{uuid.uuid4().hex}")
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                yield cursor.description, rows
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+
+    def __decrypt_records(self, records: list) -> list:
+        """ The method decrypts chunk of ciphertexts via REST batch API, keeping None for missing ones """
+        present = [record for record in records if record is not None]
+        decrypted = iter(self.rest_sample.decrypt_many(present))
+        return [None if record is None else next(decrypted) for record in records]
+
+    @staticmethod
+    def __to_postgres_literal(value: [dict, Ciphertext, str]) -> str:
+        """ The method converts ciphertext in any supported form into Postgres string """
+        if isinstance(value, dict):
+            return Ciphertext.from_dict(value).to_postgres()
+        if isinstance(value, Ciphertext):
+            return value.to_postgres()
+
+        return value
+
+    @staticmethod
+    def __copy_value(value: [str, None]) -> str:
+        """ The method gives value for COPY text format, where NULL is written as '\\N' """
+        return "\\N" if value is None else value
+
     def is_lower_case(self, the_name: str) -> bool:
         """ The method validates whether it's lower case or not """
         if not the_name.islower():
-            print("Please follow only 'snake_case' naming convention for columns and attributes.")
+            self.log("Please follow only 'snake_case' naming convention for columns and attributes.")
             return False
 
         return True
@@ -240,6 +949,62 @@ class MathLockPostgresSample:
     # endregion
 
 
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """ psycopg2 connection, which counts commits and gives InstrumentedCursor by default. Metrics are taken from
+    its attribute 'metrics', nothing is recorded while it's None """
+    metrics = None
+
+    def cursor(self, *args, **kwargs) -> psycopg2.extensions.cursor:
+        kwargs.setdefault("cursor_factory", InstrumentedCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        super().commit()
+        if self.metrics is not None:
+            self.metrics.increment("mathlock_commits_total")
+            self.metrics.increment("mathlock_round_trips_total", kind="sql")
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """ psycopg2 cursor, which measures every statement by its SQL command (SELECT, UPDATE, EXECUTE etc.), and counts
+    round trips, bytes of sent statements and errors. Metrics are taken from its connection """
+    __command = re.compile(r"\s*(\w+)")
+
+    def execute(self, query, params=None) -> None:
+        self.__measure(query, super().execute, query, params)
+
+    def executemany(self, query, params_list) -> None:
+        self.__measure(query, super().executemany, query, params_list)
+
+    def copy_expert(self, sql, file, size: int = 8192) -> None:
+        # 'query' of the cursor isn't set by COPY, so the statement itself is measured
+        text = sql.encode() if isinstance(sql, str) else sql if isinstance(sql, bytes) else str(sql).encode()
+        self.__measure(sql, super().copy_expert, sql, file, size, sent_bytes=len(text))
+
+    def __measure(self, query, method: Callable, *args, sent_bytes: [int, None] = None) -> None:
+        """ executes the statement, measuring it. Sent bytes are taken from the executed query, unless given """
+        metrics = getattr(self.connection, "metrics", None)
+        if metrics is None:
+            method(*args)
+            return
+
+        if isinstance(query, bytes):  # e.g. execute_values gives already composed query
+            query = query.decode(errors="replace")
+        match = self.__command.match(query if isinstance(query, str) else str(query))
+        command = match.group(1).upper() if match else "UNKNOWN"
+        start_time = time.perf_counter()
+        try:
+            method(*args)
+        except Exception:
+            metrics.increment("mathlock_errors_total", kind="sql", operation=command)
+            raise
+        finally:
+            metrics.observe("mathlock_sql_statement_seconds", time.perf_counter() - start_time, statement=command)
+            metrics.increment("mathlock_round_trips_total", kind="sql")
+            metrics.increment("mathlock_bytes_sent_total", len(self.query or b"") if sent_bytes is None else sent_bytes,
+                              kind="sql")
+
+
 def run():
     """ Runs entire execution """
 
@@ -258,30 +1023,21 @@ def run():
     # By default, we create only records with indexes for the above set of values, every time deleting the table.
     # If you want to avoid deletion or extend it anyhow - feel free.
     # and to use multiple indexes - comment out deletion line and change the code accordingly
-    for num1, num2, rec_index in zip(set_values1, set_values2, indexes):
-        encrypted1 = postgres_sample.rest_do_encryption(num1)
-        encrypted2 = postgres_sample.rest_do_encryption(num2)
-
-        st1 = postgres_sample.build_string_for_postgres(encrypted1)
-        st2 = postgres_sample.build_string_for_postgres(encrypted2)
-        postgres_sample.insert_into_table(tab_name, rec_index, st1, st2)
-
-        # perform all 4 homomorphic operations and add into the table for relative columns
-        postgres_sample.homomorphic_division(tab_name, rec_index)
-        postgres_sample.homomorphic_multiplication(tab_name, rec_index)
-        postgres_sample.homomorphic_addition(tab_name, rec_index)
-        postgres_sample.homomorphic_subtraction(tab_name, rec_index)
-
-        # fetch homomorphic results and decrypt them
-        mult_result = postgres_sample.select_math_result_by_row_id(tab_name, rec_index, postgres_sample.mult_result)
-        add_result = postgres_sample.select_math_result_by_row_id(tab_name, rec_index, postgres_sample.add_result)
-        div_result = postgres_sample.select_math_result_by_row_id(tab_name, rec_index, postgres_sample.div_result)
-        sub_result = postgres_sample.select_math_result_by_row_id(tab_name, rec_index, postgres_sample.sub_result)
-
-        postgres_sample.rest_do_decryption(mult_result, "multiplication")
-        postgres_sample.rest_do_decryption(div_result, "division")
-        postgres_sample.rest_do_decryption(add_result, "addition")
-        postgres_sample.rest_do_decryption(sub_result, "subtraction")
+    # All rows are streamed through the pipeline: encryption -> insert -> all 4 homomorphic operations -> fetch of
+    # results -> decryption, where REST API calls of some rows overlap with SQL of other rows. Amount of workers is
+    # kept small, since the demo DB and REST server are shared with other users
+    report = postgres_sample.run_pipeline(tab_name, zip(indexes, set_values1, set_values2), rest_workers=2,
+                                          db_workers=1)
+    for rec_index, results in sorted(report["results"], key=lambda result: result[0]):
+        for ops_type, res in results.items():
+            print(f"Row ID {rec_index}, result after decryption for {ops_type} is: {res['value']}")
+
+    failed = sorted(set(indexes) - {rec_index for rec_index, _ in report["results"]})
+    if failed:
+        print(f"Row IDs {failed} failed:")
+        for stage_name, stats in report["stages"].items():
+            if stats["errors"]:
+                print(f"  stage {stage_name}: {stats['errors']} errors, the first one: {stats['first_error']}")
 
     print("\n Our encrypted table view: ")
     postgres_sample.print_entire_table(tab_name)